@@ -16,6 +16,7 @@ except ModuleNotFoundError as e:
 def extract_kurodlc_data_to_dlc_maker_format (json_name):
     kt = kuro_tables()
     kt.read_kurodlc_json(json_name)
+    reference_index = kt.get_reference_index()
     dlc_data = {}
     mdl_data = {}
     costume_entries_present = False
@@ -33,12 +34,6 @@ def extract_kurodlc_data_to_dlc_maker_format (json_name):
         if 'DLCTableData' in kt.new_entries and len(kt.new_entries['DLCTableData']) > 0:
             dlc_entries_present = True
         if 'ShopItem' in kt.new_entries and len(kt.new_entries['ShopItem']) > 0:
-            shop_by_item = {}
-            for i in range(len(kt.new_entries['ShopItem'])):
-                if kt.new_entries['ShopItem'][i]['item_id'] in shop_by_item:
-                    shop_by_item[kt.new_entries['ShopItem'][i]['item_id']].append(kt.new_entries['ShopItem'][i]['shop_id'])
-                else:
-                    shop_by_item[kt.new_entries['ShopItem'][i]['item_id']] = [kt.new_entries['ShopItem'][i]['shop_id']]
             shop_entries_present = True
     elif 'CostumeTable' in kt.new_entries and len(kt.new_entries['CostumeTable']) > 0: # Ys X
         game_type = 'ys_x'
@@ -51,21 +46,10 @@ def extract_kurodlc_data_to_dlc_maker_format (json_name):
         if 'DLCTable' in kt.new_entries and len(kt.new_entries['DLCTable']) > 0:
             dlc_entries_present = True
         if 'ProductInfo' in kt.new_entries and len(kt.new_entries['ProductInfo']) > 0:
-            recipe_by_item = {}
-            item_by_recipe = {}
-            shop_by_item = {}
-            for i in range(len(kt.new_entries['RecipeTableData'])):
-                recipe_by_item[kt.new_entries['RecipeTableData'][i]['item_id']] = kt.new_entries['RecipeTableData'][i]['recipe_id']
-                item_by_recipe[kt.new_entries['RecipeTableData'][i]['recipe_id']] = kt.new_entries['RecipeTableData'][i]['item_id']
-            for j in range(len(kt.new_entries['ProductInfo'])):
-                if item_by_recipe[kt.new_entries['ProductInfo'][j]['recipe_id']] in shop_by_item:
-                    shop_by_item[item_by_recipe[kt.new_entries['ProductInfo'][j]['recipe_id']]].append(kt.new_entries['ProductInfo'][j]['shop_id'])
-                else:
-                    shop_by_item[item_by_recipe[kt.new_entries['ProductInfo'][j]['recipe_id']]] = [kt.new_entries['ProductInfo'][j]['shop_id']]
             recipe_ids_present = True
             shop_entries_present = True
     if costume_entries_present == True:
-        item_quantity_dict = {}
+        dlc_id = None
         if dlc_entries_present == True:
             dlc_dict_keys = kt.get_schema(dlc_table_key, kt.schema_dict[dlc_table_key])['keys']
             dlc_data['game_type'] = game_type
@@ -74,25 +58,23 @@ def extract_kurodlc_data_to_dlc_maker_format (json_name):
             dlc_data['dlc_name'] = dlc_data.pop('name')
             dlc_data['dlc_desc'] = dlc_data.pop('desc')
             dlc_data['dlc_filename'] = json_name.replace('\\','/').split('/')[-1].split('.kurodlc.json')[0]
-            item_quantity_dict = {kt.new_entries[dlc_table_key][0]['items'][i]: kt.new_entries[dlc_table_key][0]['quantity'][i]
-                for i in range(len(kt.new_entries[dlc_table_key][0]['items']))}
+            dlc_id = kt.new_entries[dlc_table_key][0]['id']
         item_dict_keys = kt.get_schema(item_table_key, kt.schema_dict[item_table_key])['keys']
         for costume in kt.new_entries[costume_table_key]:
-            mdl_data[costume[mdl_key]] = {'id': costume['item_id']}
-            if item_table_key in kt.new_entries and len(kt.new_entries[item_table_key]) > 0:
-                matching_items = [x for x in kt.new_entries[item_table_key] if x['id'] == mdl_data[costume[mdl_key]]['id']]
-                if len(matching_items) > 0: # Should be no more than 1 as 'id' is a primary key
-                    mdl_data[costume[mdl_key]].update(
-                        {key:matching_items[0][key] for key in item_dict_keys if key in matching_items[0]})
+            item_id = costume['item_id']
+            mdl_data[costume[mdl_key]] = {'id': item_id}
+            # An item id listed more than once uses the last row, the same one kurodlc_make_tbls.py puts in the table
+            if item_id in reference_index.items:
+                mdl_data[costume[mdl_key]].update(
+                    {key:reference_index.items[item_id][key] for key in item_dict_keys if key in reference_index.items[item_id]})
             mdl_data[costume[mdl_key]]['chr_restrict'] = costume[char_restrict_key] # This overrides the item version
-            if mdl_data[costume[mdl_key]]['id'] in item_quantity_dict:
-                mdl_data[costume[mdl_key]]['item_quantity'] = item_quantity_dict[mdl_data[costume[mdl_key]]['id']]
-            else:
-                mdl_data[costume[mdl_key]]['item_quantity'] = 1
-            if recipe_ids_present == True and mdl_data[costume[mdl_key]]['id'] in recipe_by_item:
-                mdl_data[costume[mdl_key]]['recipe_id'] = recipe_by_item[mdl_data[costume[mdl_key]]['id']]
-            if shop_entries_present == True and mdl_data[costume[mdl_key]]['id'] in shop_by_item:
-                mdl_data[costume[mdl_key]]['stores'] = shop_by_item[mdl_data[costume[mdl_key]]['id']]
+            # Quantity of the item in the (first) DLC of the file
+            quantities = [x[1] for x in reference_index.dlcs_by_item.get(item_id, []) if x[0] == dlc_id]
+            mdl_data[costume[mdl_key]]['item_quantity'] = quantities[-1] if len(quantities) > 0 else 1
+            if recipe_ids_present == True and item_id in reference_index.recipes_by_item:
+                mdl_data[costume[mdl_key]]['recipe_id'] = reference_index.recipes_by_item[item_id][-1]
+            if shop_entries_present == True and item_id in reference_index.shops:
+                mdl_data[costume[mdl_key]]['stores'] = reference_index.shops[item_id]
     return(dlc_data, mdl_data)
 
 def process_kurodlc_json (json_name, overwrite = False):
@@ -9,23 +9,21 @@
 
 try:
     import os, sys
-    from p3a_lib import p3a_class
+    from p3a_lib import p3a_reader
 except ModuleNotFoundError as e:
     print("Python module missing! {}".format(e.msg))
     input("Press Enter to abort.")
     raise   
 
 def extract_original_tbls_from_p3a (original_p3a_filename):
-    p3a = p3a_class()
     if os.path.exists(original_p3a_filename):
-        with open(original_p3a_filename,'rb') as p3a.f:
-            headers, entries, p3a_dict = p3a.read_p3a_toc()
+        with p3a_reader(original_p3a_filename) as p3a:
             files_to_extract = ['t_costume.tbl', 't_dlc.tbl', 't_item.tbl', 't_recipe.tbl', 't_shop.tbl', 't_skill.tbl', 't_voice.tbl', 't_name.tbl']
             filenames = ['t_costume.tbl.original', 't_dlc.tbl.original', 't_item.tbl.original',
                 't_recipe.tbl.original', 't_shop.tbl.original', 't_skill.tbl.original', 't_voice.tbl.original', 't_name.tbl']
             entries_to_extract = []
             for filename in files_to_extract:
-                matching_entries = [entry for entry in entries if os.path.basename(filename) == os.path.basename(entry['name'])]
+                matching_entries = p3a.find(filename)
                 if len(matching_entries) > 0:
                     if len(matching_entries) > 1:
                         print("More than one {} found, extract which file?".format(filename))
@@ -43,7 +41,7 @@ def extract_original_tbls_from_p3a (original_p3a_filename):
                         entries_to_extract.append(matching_entries[0])
             print("files: {}".format([x['name'] for x in entries_to_extract]))
             for i in range(len(entries_to_extract)):
-                file_data = p3a.read_file(entries_to_extract[i], p3a_dict)
+                file_data = p3a.read(entries_to_extract[i])
                 if len(file_data) > 0:
                     with open(filenames[files_to_extract.index(os.path.basename(entries_to_extract[i]['name']))], 'wb') as f2:
                         f2.write(file_data)
@@ -26,20 +26,19 @@ if __name__ == "__main__":
 
     # Read t_dlc.tbl.original (or t_dlc.tbl if original not available)
     if os.path.exists('t_dlc.tbl.original'):
-        t_dlc = kt.read_table('t_dlc.tbl.original')
+        t_dlc = kt.read_table('t_dlc.tbl.original', sections = ['DLCTableData', 'DLCTable'], columns = ['id', 'name'])
     else:
-        t_dlc = kt.read_table('t_dlc.tbl')
+        t_dlc = kt.read_table('t_dlc.tbl', sections = ['DLCTableData', 'DLCTable'], columns = ['id', 'name'])
         
     # Read *.kurodlc.json files and add to table (in memory)
     kt.read_all_kurodlc_jsons()
-    t_dlc = kt.update_table_with_kurodlc(t_dlc)
     
     if 'DLCTable' in kt.schema_dict: # Ys X
-        dlcs = {x['id']:x['name'] for x in t_dlc['DLCTable']}
+        dlcs = {k:x['name'] for k,x in kt.get_merged_section(t_dlc, 'DLCTable').items()}
         # Dunno what the actual upper limit of DLC IDs is
         id_lower_limit, id_upper_limit = 0, 350
     else: # Kuro 1 / 2
-        dlcs = {x['id']:x['name'] for x in t_dlc['DLCTableData']}
+        dlcs = {k:x['name'] for k,x in kt.get_merged_section(t_dlc, 'DLCTableData').items()}
         # Dunno what the actual upper limit of DLC IDs is
         id_lower_limit, id_upper_limit = 0, 350
 
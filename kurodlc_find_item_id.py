@@ -26,14 +26,13 @@ if __name__ == "__main__":
 
     # Read t_item.tbl.original (or t_item.tbl if original not available)
     if os.path.exists('t_item.tbl.original'):
-        t_item = kt.read_table('t_item.tbl.original')
+        t_item = kt.read_table('t_item.tbl.original', sections = ['ItemTableData'], columns = ['id', 'name'])
     else:
-        t_item = kt.read_table('t_item.tbl')
+        t_item = kt.read_table('t_item.tbl', sections = ['ItemTableData'], columns = ['id', 'name'])
         
     # Read *.kurodlc.json files and add to table (in memory)
     kt.read_all_kurodlc_jsons()
-    t_item = kt.update_table_with_kurodlc(t_item)
-    items = {x['id']:x['name'] for x in t_item['ItemTableData']}
+    items = {k:x['name'] for k,x in kt.get_merged_section(t_item, 'ItemTableData').items()}
 
     if kt.schema_dict['ItemTableData'] == 176: # Ys X
         # Dunno what the actual upper limit of item IDs is
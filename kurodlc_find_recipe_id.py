@@ -26,16 +26,15 @@ if __name__ == "__main__":
 
     # Read t_recipe.tbl.original (or t_recipe.tbl if original not available)
     if os.path.exists('t_recipe.tbl.original'):
-        t_recipe = kt.read_table('t_recipe.tbl.original')
+        t_recipe = kt.read_table('t_recipe.tbl.original', sections = ['RecipeTableData'], columns = ['recipe_id', 'item_id'])
     else:
-        t_recipe = kt.read_table('t_recipe.tbl')
+        t_recipe = kt.read_table('t_recipe.tbl', sections = ['RecipeTableData'], columns = ['recipe_id', 'item_id'])
         
     # Read *.kurodlc.json files and add to table (in memory)
     kt.read_all_kurodlc_jsons()
-    t_recipe = kt.update_table_with_kurodlc(t_recipe)
     
     if 'RecipeTableData' in kt.schema_dict: # Ys X
-        recipes = {x['recipe_id']:x['item_id'] for x in t_recipe['RecipeTableData']}
+        recipes = {k:x['item_id'] for k,x in kt.get_merged_section(t_recipe, 'RecipeTableData').items()}
         # Dunno what the actual upper limit of Recipe IDs is
         id_lower_limit, id_upper_limit = 0, 200000
     else: # Kuro 1 / 2
@@ -4,48 +4,481 @@
 # GitHub eArmada8/kuro_dlc_tool
 
 try:
-    import json, struct, shutil, glob, os, sys
+    import json, struct, shutil, glob, marshal, mmap, operator, re, os, sys, threading
+    import concurrent.futures
 except ModuleNotFoundError as e:
     print("Python module missing! {}".format(e.msg))
     input("Press Enter to abort.")
     raise   
 
+try:
+    import xxhash # Optional, the decoded table cache is disabled without it
+except ModuleNotFoundError:
+    xxhash = None
+
+# Decoded .tbl.original files are cached next to the original as .tbl.original.cache
+table_cache_version = 1
+table_cache_max_size = 64 * 1024 * 1024 # Tables that decode to more than this are not cached
+# Validated .kurodlc.json files are cached next to the mod as .kurodlc.json.cache
+kurodlc_cache_version = 1
+# Starting worker processes takes longer than reading this much .kurodlc.json sequentially
+kurodlc_parallel_min_size = 16 * 1024 * 1024
+# ProcessPoolExecutor refuses more than 61 workers on Windows
+max_process_workers = 61 if sys.platform == 'win32' else None
+
+# Schemas from kurodlc_schema.json, loaded once per process and shared by every kuro_tables instance.
+# The parsed schemas are kept in kurodlc_schema.cache (marshal format), which is used instead of the
+# JSON as long as the size and modification time of kurodlc_schema.json are unchanged.
+class kuro_schema_registry:
+    cache_version = 2
+
+    def __init__(self, schema_filename):
+        self.schema_filename = schema_filename
+        self.cache_filename = os.path.splitext(schema_filename)[0] + '.cache'
+        self.loaded = False
+        self.schemas = {} # Indexed by (table_header, schema_length)
+        self.schema_hash = '' # xxhash64 of kurodlc_schema.json, if xxhash is available
+        self.codecs = {}
+
+    # Returns False if kurodlc_schema.json is missing
+    def load(self):
+        if self.loaded == True:
+            return(True)
+        if not os.path.exists(self.schema_filename):
+            return(False)
+        stat = os.stat(self.schema_filename)
+        cache_key = [self.cache_version, marshal.version, stat.st_size, stat.st_mtime_ns, xxhash is not None]
+        if os.path.exists(self.cache_filename):
+            try:
+                with open(self.cache_filename, 'rb') as f:
+                    cache = marshal.loads(f.read())
+                if isinstance(cache, dict) and cache.get('key') == cache_key:
+                    self.schemas, self.schema_hash = cache['schemas'], cache['schema_hash']
+                    self.loaded = True
+            except (EOFError, ValueError, TypeError):
+                pass # Unreadable cache, it will be replaced
+        if self.loaded == False:
+            raw_schema = open(self.schema_filename,'rb').read()
+            if xxhash is not None:
+                self.schema_hash = xxhash.xxh64_hexdigest(raw_schema)
+            kurodlc_schema = json.loads(raw_schema)
+            self.schemas = {(x['table_header'],x['schema_length']):x['schema'] for x in kurodlc_schema}
+            try:
+                with open(self.cache_filename + '.tmp', 'wb') as f:
+                    f.write(marshal.dumps({'key': cache_key, 'schemas': self.schemas, 'schema_hash': self.schema_hash}))
+                os.replace(self.cache_filename + '.tmp', self.cache_filename)
+            except OSError:
+                pass # The cache is optional, run without it if the folder is not writable
+            self.loaded = True
+        return(True)
+
+    # Row codecs are compiled once per schema
+    def get_codec(self, name, entry_length):
+        if not (name, entry_length) in self.codecs:
+            self.codecs[(name, entry_length)] = kuro_row_codec(self.schemas[(name, entry_length)])
+        return(self.codecs[(name, entry_length)])
+
+schema_registry = kuro_schema_registry(os.path.abspath(os.path.join(os.path.dirname(__file__), 'kurodlc_schema.json')))
+
+class kuro_row_codec:
+    def __init__(self, schema):
+        self.struct = struct.Struct(schema['schema'])
+        self.keys = schema['keys']
+        self.values = schema['values']
+        assert len(self.keys) == len(self.values)
+        # Column slots, key:(value type, position in the unpacked struct)
+        self.slots = {}
+        i = 0
+        for j in range(len(self.values)):
+            self.slots[self.keys[j]] = (self.values[j], i)
+            i += 2 if self.values[j] in ['a', 'b'] else 1
+        # Value of the primary key of a row, a tuple for multi-column primary keys
+        if 'primary_key' in schema and isinstance(schema['primary_key'], list):
+            primary_key = schema['primary_key']
+            self.get_primary_key = lambda row: tuple(row[j] for j in primary_key if j in row)
+        elif 'primary_key' in schema:
+            self.get_primary_key = operator.itemgetter(schema['primary_key'])
+        else:
+            self.get_primary_key = None
+        self.check_row = self.compile_validator()
+        self.decode_rows = self.compile_decoder(self.keys)
+        self.encode_row = self.compile_encoder()
+        self.get_fingerprint = self.compile_fingerprint()
+        self.projected_decoders = {tuple(self.keys): self.decode_rows}
+        self.numpy_dtype = None # Filled in by get_numpy_dtype()
+
+    # Decoder for only the requested columns (in schema order), pointers of other columns are never followed
+    def get_decoder(self, columns = None):
+        if columns is None:
+            return(self.decode_rows)
+        keys = tuple(x for x in self.keys if x in columns)
+        if not keys in self.projected_decoders:
+            self.projected_decoders[keys] = self.compile_decoder(keys)
+        return(self.projected_decoders[keys])
+
+    # Same result as get_decoder(columns), but from already decoded rows
+    def project_rows(self, rows, columns = None):
+        if columns is None:
+            return(rows)
+        keys = [x for x in self.keys if x in columns]
+        return([{key:x[key] for key in keys} for x in rows])
+
+    # Structured dtype with one field (f0, f1, ...) per value in the struct, in struct order
+    def get_numpy_dtype(self):
+        import numpy
+        if self.numpy_dtype is None:
+            numpy_types = {'b': 'i1', 'B': 'u1', 'h': '<i2', 'H': '<u2', 'i': '<i4', 'I': '<u4',
+                'q': '<i8', 'Q': '<u8', 'f': '<f4', 'd': '<f8'}
+            codes = []
+            for count, code in re.findall(r'(\d*)([a-zA-Z])', self.struct.format.lstrip('<')):
+                codes.extend([code] * (int(count) if count != '' else 1))
+            self.numpy_dtype = numpy.dtype([('f{}'.format(i), numpy_types[codes[i]]) for i in range(len(codes))])
+        return(self.numpy_dtype)
+
+    # check_row(row) returns the keys whose values do not match the schema, row must have every key
+    def compile_validator(self):
+        checks = []
+        for key in self.keys:
+            value_type, i = self.slots[key]
+            if value_type == 'n':
+                check = "isinstance(v, (int, float))"
+            elif value_type in ['a', 'b']:
+                check = "isinstance(v, list) and all([isinstance(k, int) for k in v])"
+            elif value_type == 't':
+                check = "isinstance(v, str)"
+            checks.append("    v = row[{0!r}]\n    if not ({1}):\n        bad_keys.append({0!r})\n".format(key, check))
+        source = "def check_row(row):\n    bad_keys = []\n" + "".join(checks) + "    return bad_keys\n"
+        namespace = {}
+        exec(source, namespace)
+        return(namespace['check_row'])
+
+    # Checks key order and value types of every row in a single pass.  Rows with all the keys of the schema
+    # but in a different order (or with extra keys) are rebuilt in schema order, other rows are untouched.
+    # Returns {'keys' or failing key: [row numbers]}, empty if every row is valid.
+    def validate_rows(self, rows):
+        keys = tuple(self.keys)
+        key_set = set(self.keys)
+        invalid_rows = {}
+        for i in range(len(rows)):
+            if not tuple(rows[i]) == keys:
+                if key_set.issubset(rows[i]):
+                    rows[i] = {x:rows[i][x] for x in keys}
+                else:
+                    invalid_rows.setdefault('keys', []).append(i)
+                    continue
+            for bad_key in self.check_row(rows[i]):
+                invalid_rows.setdefault(bad_key, []).append(i)
+        return(invalid_rows)
+
+    # get_fingerprint(row) returns the values of a decoded row as a hashable tuple (arrays become tuples), so rows
+    # can be compared through sets and dicts instead of comparing the dicts one by one
+    def compile_fingerprint(self):
+        fields = []
+        for key in self.keys:
+            if self.slots[key][0] in ['a', 'b']:
+                fields.append("tuple(row[{0!r}])".format(key))
+            else:
+                fields.append("row[{0!r}]".format(key))
+        source = "def get_fingerprint(row):\n"\
+            + "    return ({0},)\n".format(", ".join(fields))
+        namespace = {}
+        exec(source, namespace)
+        return(namespace['get_fingerprint'])
+
+    # decode_rows(raw_rows, read_array, read_short_array, read_null_term_str) returns a list of row dicts
+    def compile_decoder(self, keys):
+        fields = []
+        for key in keys:
+            value_type, i = self.slots[key]
+            if value_type == 'n':
+                fields.append("{0!r}: r[{1}]".format(key, i))
+            elif value_type == 'a':
+                fields.append("{0!r}: read_array(r[{1}], r[{2}])".format(key, i, i+1))
+            elif value_type == 'b':
+                fields.append("{0!r}: read_short_array(r[{1}], r[{2}])".format(key, i, i+1))
+            elif value_type == 't':
+                fields.append("{0!r}: read_null_term_str(r[{1}])".format(key, i))
+        source = "def decode_rows(raw_rows, read_array, read_short_array, read_null_term_str):\n"\
+            + "    return [{{{0}}} for r in raw_rows]\n".format(", ".join(fields))
+        namespace = {}
+        exec(source, namespace)
+        return(namespace['decode_rows'])
+
+    # encode_row(buffer, offset, row, write_array, write_short_array, write_null_term_str) packs the fixed-length
+    # row into buffer at offset, the array writers return (offset, count) and the string writer returns the offset
+    def compile_encoder(self):
+        fields = []
+        for key in self.keys:
+            value_type, i = self.slots[key]
+            if value_type == 'n':
+                fields.append("row[{0!r}]".format(key))
+            elif value_type == 'a':
+                fields.append("*write_array(row[{0!r}])".format(key))
+            elif value_type == 'b':
+                fields.append("*write_short_array(row[{0!r}])".format(key))
+            elif value_type == 't':
+                fields.append("write_null_term_str(row[{0!r}])".format(key))
+        source = "def encode_row(buffer, offset, row, write_array, write_short_array, write_null_term_str):\n"\
+            + "    pack_into(buffer, offset, {0})\n".format(", ".join(fields))
+        namespace = {'pack_into': self.struct.pack_into}
+        exec(source, namespace)
+        return(namespace['encode_row'])
+
+# A single table section, decoded in bulk and only turned into row dicts when asked.
+# data can be any buffer supporting slicing and find() (bytes or mmap).
+class kuro_section:
+    def __init__(self, codec, data, start_offset, num_entries):
+        self.codec = codec
+        self.data = data
+        self.start_offset = start_offset
+        self.num_entries = num_entries
+        self.raw_rows = None
+        self.array = None
+
+    def __len__(self):
+        return(self.num_entries)
+
+    def __iter__(self):
+        return(iter(self.rows()))
+
+    def __getitem__(self, i):
+        return(self.decode([self.get_raw_rows()[i]])[0])
+
+    def get_block(self):
+        return(self.data[self.start_offset:self.start_offset + self.num_entries * self.codec.struct.size])
+
+    def get_raw_rows(self):
+        if self.raw_rows is None:
+            self.raw_rows = list(self.codec.struct.iter_unpack(self.get_block()))
+        return(self.raw_rows)
+
+    # NumPy structured array of the fixed-length rows, or None if NumPy is not installed.
+    # NumPy is optional and only imported here, as importing it is slow.
+    def get_array(self):
+        try:
+            import numpy
+        except ModuleNotFoundError:
+            return(None)
+        if self.array is None:
+            self.array = numpy.frombuffer(self.get_block(), dtype = self.codec.get_numpy_dtype(), count = self.num_entries)
+        return(self.array)
+
+    def decode(self, raw_rows, columns = None):
+        data = self.data
+        def read_array(offset, numvalues): #u32
+            arr = []
+            if numvalues > 0:
+                arr.extend(struct.unpack_from("<{}I".format(numvalues), data, offset))
+            return(arr)
+        def read_short_array(offset, numvalues): #u16
+            arr = []
+            if numvalues > 0:
+                arr.extend(struct.unpack_from("<{}H".format(numvalues), data, offset))
+            return(arr)
+        def read_null_term_str(offset):
+            return(data[offset:data.find(b'\x00', offset)].decode('utf-8'))
+        return(self.codec.get_decoder(columns)(raw_rows, read_array, read_short_array, read_null_term_str))
+
+    def rows(self, columns = None):
+        return(self.decode(self.get_raw_rows(), columns))
+
+    # Numeric columns are returned as a NumPy array when available, everything else as a list
+    def column(self, key):
+        value_type, i = self.codec.slots[key]
+        if value_type == 'n':
+            if self.get_array() is not None:
+                return(self.array['f{}'.format(i)])
+            return([x[i] for x in self.get_raw_rows()])
+        return([x[key] for x in self.rows([key])])
+
+# The string / array region of a table being written.  Strings and arrays are appended to buffer, which
+# will be placed at start_offset in the table.  If pool_data is True, identical strings and arrays are only
+# written once and share an offset.  One writer is used per table, so tables can be encoded concurrently.
+class kuro_data2_writer:
+    def __init__(self, start_offset, pool_data = False):
+        self.start_offset = start_offset
+        self.buffer = bytearray()
+        self.pool = {} if pool_data == True else None
+
+    def write_array(self, data_list): #u32
+        if self.pool is not None and ('a', tuple(data_list)) in self.pool:
+            return(self.pool[('a', tuple(data_list))], len(data_list))
+        #32-bit alignment
+        self.buffer.extend(b'\x00' * (-len(self.buffer) % 4))
+        data_offset = len(self.buffer) + self.start_offset
+        self.buffer.extend(struct.pack("<{}I".format(len(data_list)), *data_list))
+        if self.pool is not None:
+            self.pool[('a', tuple(data_list))] = data_offset
+        return(data_offset, len(data_list))
+
+    def write_short_array(self, data_list): #u16
+        if self.pool is not None and ('b', tuple(data_list)) in self.pool:
+            return(self.pool[('b', tuple(data_list))], len(data_list))
+        #16-bit alignment
+        self.buffer.extend(b'\x00' * (-len(self.buffer) % 2))
+        data_offset = len(self.buffer) + self.start_offset
+        self.buffer.extend(struct.pack("<{}H".format(len(data_list)), *data_list))
+        if self.pool is not None:
+            self.pool[('b', tuple(data_list))] = data_offset
+        return(data_offset, len(data_list))
+
+    def write_null_term_str(self, string):
+        if self.pool is not None and ('t', string) in self.pool:
+            return(self.pool[('t', string)])
+        data_offset = len(self.buffer) + self.start_offset
+        self.buffer.extend(string.encode('utf-8'))
+        self.buffer.append(0)
+        if self.pool is not None:
+            self.pool[('t', string)] = data_offset
+        return(data_offset)
+
+# Lookups between related sections by item (and DLC / recipe) id, so scripts do not have to scan the rows.
+# sections is {section name: rows}, e.g. a table from read_table() or kuro_tables.new_entries; add_sections()
+# can be called again with more sections, which are merged the same way as update_table_with_kurodlc() does:
+# rows of sections with a primary key (ItemTableData, DLCTableData / DLCTable, RecipeTableData, CostumeTable)
+# replace earlier rows with the same key, rows of the other sections (CostumeParam, ShopItem, ProductInfo)
+# are added to them.  Kuro (CostumeParam, DLCTableData, ShopItem) and Ys X (CostumeTable, DLCTable,
+# RecipeTableData, ProductInfo) sections are both supported.
+class kuro_reference_index:
+    def __init__(self, sections = {}):
+        self.items = {} # item id: item row
+        self.dlcs = {} # dlc id: dlc row
+        self.recipes = {} # recipe id: recipe row
+        self.costume_table = {} # item id: CostumeTable row
+        self.costume_params = [] # CostumeParam rows
+        self.shop_items = [] # ShopItem rows
+        self.product_infos = [] # ProductInfo rows
+        # Built from the rows above by update_lookups()
+        self.costumes = {} # item id: [costume rows]
+        self.dlcs_by_item = {} # item id: [(dlc id, quantity)]
+        self.shops = {} # item id: [shop ids], from ShopItem or from ProductInfo through the recipe
+        self.recipes_by_item = {} # item id: [recipe ids]
+        self.add_sections(sections)
+
+    def add_sections(self, sections):
+        for x in sections.get('ItemTableData', []):
+            self.items[x['id']] = x
+        for key in ['DLCTableData', 'DLCTable']:
+            for x in sections.get(key, []):
+                self.dlcs[x['id']] = x
+        for x in sections.get('RecipeTableData', []):
+            self.recipes[x['recipe_id']] = x
+        for x in sections.get('CostumeTable', []):
+            self.costume_table[x['item_id']] = x
+        self.costume_params.extend(sections.get('CostumeParam', []))
+        self.shop_items.extend(sections.get('ShopItem', []))
+        self.product_infos.extend(sections.get('ProductInfo', []))
+        self.update_lookups()
+        return
+
+    # The lookups by item are rebuilt from scratch, so replaced rows leave nothing behind and ProductInfo
+    # rows are linked to the recipes as they are now, including recipes added after the ProductInfo rows
+    def update_lookups(self):
+        self.costumes, self.dlcs_by_item, self.shops, self.recipes_by_item = {}, {}, {}, {}
+        for x in self.costume_params + list(self.costume_table.values()):
+            self.costumes.setdefault(x['item_id'], []).append(x)
+        for x in self.dlcs.values():
+            if 'items' in x and 'quantity' in x:
+                for i in range(len(x['items'])):
+                    self.dlcs_by_item.setdefault(x['items'][i], []).append((x['id'], x['quantity'][i]))
+        for x in self.shop_items:
+            self.shops.setdefault(x['item_id'], []).append(x['shop_id'])
+        for x in self.recipes.values():
+            self.recipes_by_item.setdefault(x['item_id'], []).append(x['recipe_id'])
+        for x in self.product_infos:
+            if x['recipe_id'] in self.recipes:
+                self.shops.setdefault(self.recipes[x['recipe_id']]['item_id'], []).append(x['shop_id'])
+        return
+
 class kuro_tables:
-    def __init__(self):
+    # table_roots are the folders searched (non-recursively) for .tbl / .tbl.original files
+    # to learn the section names, crcs and entry lengths before any table is read.  use_table_cache
+    # controls both the decoded .tbl.original cache and the validated .kurodlc.json cache.
+    def __init__(self, table_roots = ['.'], use_table_cache = True):
         self.schemas = {}
+        self.schema_hash = ''
+        self.use_table_cache = use_table_cache and xxhash is not None
         self.schema_dict = {}
         self.crc_dict = {}
         self.missing_schemas = []
-        self.data2_start_offset = 0
-        self.data2_buffer = b''
         self.new_entries = {}
         self.new_entries_sources = {}
+        self.merged_entries = {} # Filled in by get_merged_entries()
+        self.kurodlc_json_sections = {} # {.kurodlc.json name: [sections]}, for every file that has been added
+        self.table_roots = table_roots
         self.init_schemas()
 
     def init_schemas(self):
-        schema_filename = os.path.abspath(os.path.join(os.path.dirname(__file__), 'kurodlc_schema.json'))
-        if os.path.exists(schema_filename):
-            kurodlc_schema = json.loads(open(schema_filename,'rb').read())
-            self.schemas = {(x['table_header'],x['schema_length']):x['schema'] for x in kurodlc_schema}
+        if schema_registry.load() == True:
+            self.schemas = schema_registry.schemas
+            self.schema_hash = schema_registry.schema_hash
         else:
             print("kurodlc_schema.json is missing!  This tool will not be able to read tables.")
             input("Press Enter to continue.")
-        tables = glob.glob('**/*.tbl.original', recursive = True) \
-            + [x for x in glob.glob('**/*.tbl', recursive = True) if not os.path.exists(x+'.original')]
+        tables = []
+        for root in self.table_roots:
+            tables.extend(glob.glob(os.path.join(glob.escape(root), '*.tbl.original')))
+        for root in self.table_roots:
+            tables.extend([x for x in glob.glob(os.path.join(glob.escape(root), '*.tbl'))
+                if not os.path.exists(x+'.original')])
+        header_index = self.read_header_index(tables) if len(tables) > 0 else {}
         for table_name in tables:
+            for name, crc, entry_length in header_index[os.path.abspath(table_name)]:
+                if not name in self.crc_dict:
+                    self.crc_dict[name] = crc
+                self.schema_dict[name] = entry_length
+        return
+
+    # Learns the section names, crcs and entry lengths of a table that is only in memory (bytes or any other
+    # buffer), in the same way as init_schemas() does for the tables in table_roots
+    def register_table_headers(self, data):
+        for header in self.read_table_headers(as_table_buffer(data)):
+            self.schema_dict[header['name']] = header['entry_length']
+        return
+
+    # Section headers of every table found by init_schemas(), cached in kurodlc_tbl_index.json and keyed
+    # by absolute path.  A file is only re-read if its size or modification time has changed.
+    def read_header_index(self, tables):
+        def read_headers(table_name):
+            headers = []
             with open(table_name, 'rb') as f:
                 magic = f.read(4)
                 if magic == b'#TBL':
                     num_sections, = struct.unpack("<I", f.read(4))
                     for i in range(num_sections):
-                        header = {}
-                        header['name'] = f.read(64).replace(b'\x00',b'').decode('utf-8')
-                        header['crc'], header['start_offset'], header['entry_length'],\
-                            header['num_entries'] = struct.unpack("<4I", f.read(16))
-                        if not header['name'] in self.crc_dict:
-                            self.crc_dict[header['name']] = header['crc']
-                        self.schema_dict[header['name']] = header['entry_length']
-        return
+                        name = f.read(64).replace(b'\x00',b'').decode('utf-8')
+                        crc, start_offset, entry_length, num_entries = struct.unpack("<4I", f.read(16))
+                        headers.append([name, crc, entry_length])
+            return(headers)
+        index_filename = os.path.abspath(os.path.join(os.path.dirname(__file__), 'kurodlc_tbl_index.json'))
+        header_index = {}
+        if os.path.exists(index_filename):
+            try:
+                header_index = json.loads(open(index_filename,'rb').read())
+            except (json.JSONDecodeError, UnicodeDecodeError):
+                header_index = {}
+        if not header_index.get('version') == 1:
+            header_index = {'version': 1, 'files': {}}
+        index_changed = False
+        for table_name in tables:
+            path = os.path.abspath(table_name)
+            stat = os.stat(path)
+            if not (path in header_index['files'] and header_index['files'][path]['size'] == stat.st_size\
+                    and header_index['files'][path]['mtime'] == stat.st_mtime_ns):
+                header_index['files'][path] = {'size': stat.st_size, 'mtime': stat.st_mtime_ns,
+                    'headers': read_headers(path)}
+                index_changed = True
+        for path in [x for x in header_index['files'] if not os.path.exists(x)]:
+            del(header_index['files'][path])
+            index_changed = True
+        if index_changed == True:
+            try:
+                with open(index_filename + '.tmp', 'wb') as f:
+                    f.write(json.dumps(header_index, indent=4).encode("utf-8"))
+                os.replace(index_filename + '.tmp', index_filename)
+            except OSError:
+                pass # The index is only a cache, run without it if the folder is not writable
+        return({x:header_index['files'][x]['headers'] for x in header_index['files']})
 
     def get_schema(self, name, entry_length):
         self.schema_dict[name] = entry_length
@@ -54,6 +487,10 @@ class kuro_tables:
         else:
             return({})
 
+    def get_codec(self, name, entry_length):
+        self.schema_dict[name] = entry_length
+        return(schema_registry.get_codec(name, entry_length))
+
     def read_struct_from_json(self, filename, raise_on_fail = True):
         with open(filename, 'r', encoding='utf-8') as f:
             try:
@@ -72,275 +509,571 @@ class kuro_tables:
             f.write(json.dumps(struct, indent=4).encode("utf-8"))
         return
 
-    # Schema must already be loaded by reading the original tables
+    # Schema must already be loaded by reading the original tables.  Rows with the keys out of order are
+    # reordered in place.  Every problem in the file is collected and reported together.
     def validate_kurodlc_entries(self, json_data, json_name):
+        errors = self.get_kurodlc_validation_errors(json_data, json_name)
+        if len(errors) > 0:
+            for error in errors:
+                print(error)
+            input("Validation of {0} failed, press Enter to abort.".format(json_name))
+            raise
+        return(json_data)
+
+    # Validates and reorders json_data in place without user interaction, returns a list of error messages
+    def get_kurodlc_validation_errors(self, json_data, json_name):
+        errors = []
         for key in [x for x in json_data if len(json_data[x]) > 0]:
             if key in self.schema_dict:
-                schema = self.get_schema(key, self.schema_dict[key])
-                if len(schema) > 0:
-                    if not all([list(json_data[key][i].keys()) == schema['keys']\
-                            for i in range(len(json_data[key]))]):
-                        if [all([x in schema['keys'] for x in list(json_data[key][i].keys())]) for i in range(len(json_data[key]))]:
-                            for i in range(len(json_data[key])):
-                                if not list(json_data[key][i].keys()) == schema['keys']:
-                                    json_data[key][i] = {x:json_data[key][i][x] for x in schema['keys']}
+                if len(self.get_schema(key, self.schema_dict[key])) > 0:
+                    invalid_rows = self.get_codec(key, self.schema_dict[key]).validate_rows(json_data[key])
+                    for problem, rows in invalid_rows.items():
+                        rows_text = ", ".join([str(x) for x in rows[:10]]) + (", ..." if len(rows) > 10 else "")
+                        if problem == 'keys':
+                            errors.append("Validation of {0} failed, schema in {1} is incorrect!  Invalid or missing keys, "\
+                                "auto-correction not possible. (entries {2})".format(json_name, key, rows_text))
                         else:
-                            print("Validation of {0} failed, schema in {1} is incorrect!".format(json_name, key))
-                            input("Invalid or missing keys, auto-correction not possible.")
-                            raise
-                    pass_value_validation = True
-                    problem_keys = []
-                    for i in range(len(schema['values'])):
-                        if schema['values'][i] == 'n':
-                            if not all([isinstance(json_data[key][j][schema['keys'][i]], int)\
-                                    or isinstance(json_data[key][j][schema['keys'][i]], float) for j in range(len(json_data[key]))]):
-                                problem_keys.append(schema['keys'][i])
-                                pass_value_validation = False
-                        elif schema['values'][i] in ['a', 'b']:
-                            if not all([isinstance(json_data[key][j][schema['keys'][i]], list)\
-                                    and all([isinstance(k, int) for k in json_data[key][j][schema['keys'][i]]])\
-                                    for j in range(len(json_data[key]))]):
-                                problem_keys.append(schema['keys'][i])
-                                pass_value_validation = False
-                        elif schema['values'][i] == 't':
-                            if not all([isinstance(json_data[key][j][schema['keys'][i]], str) for j in range(len(json_data[key]))]):
-                                problem_keys.append(schema['keys'][i])
-                                pass_value_validation = False
-                    if pass_value_validation == False:
-                        input("Validation of {0} failed, values {1} in {2} do not match the schema!".format(json_name, problem_keys, key))
-                        raise
+                            errors.append("Validation of {0} failed, values {1} in {2} do not match the schema! (entries {3})".format(
+                                json_name, [problem], key, rows_text))
                 else:
-                    input("Validation of {0} in {1} skipped, schema not found! (tbl file not supported)".format(key, json_name))
-                    raise
+                    errors.append("Validation of {0} in {1} skipped, schema not found! (tbl file not supported)".format(key, json_name))
             else:
-                input("Validation of {0} in {1} failed, schema not found! (tbl file is missing)".format(key, json_name))
-                raise
-        return(json_data)
+                errors.append("Validation of {0} in {1} failed, schema not found! (tbl file is missing)".format(key, json_name))
+        return(errors)
 
+    # self.new_entries_sources holds one index per section primary key ('<section>_primary_key') and
+    # per unique value column ('<section>_<column>'), mapping each value to the list of .kurodlc.json files
+    # that contain it.  Each file is checked against the files loaded before it, then added to the indexes.
     def detect_duplicate_entries(self, json_data, json_name):
         for key in [x for x in json_data if len(json_data[x]) > 0]:
             if key in self.schema_dict:
                 schema = self.get_schema(key, self.schema_dict[key])
-                if 'primary_key' in schema and isinstance(schema['primary_key'], list):
-                    schema['new_primary_key'] = "_".join(schema['primary_key'])
-                    for i in range(len(json_data[key])):
-                        json_data[key][i][schema['new_primary_key']] =\
-                            tuple(json_data[key][i][j] for j in schema['primary_key'] if j in json_data[key][i])
-                # Search for duplicates and report them
-                if key in self.new_entries:
-                    if 'primary_key' in schema:
-                        primary_key = schema['new_primary_key'] if 'new_primary_key' in schema else schema['primary_key']
-                        prior_id_values = [x[primary_key] for x in self.new_entries[key]]
-                        duplicates = [x for x in json_data[key] if x[primary_key] in prior_id_values]
-                        if len(duplicates) > 0:
-                            for i in range(len(duplicates)):
-                                matches = []
-                                for j in range(len(self.new_entries_sources[key+'_primary_key'])):
-                                    matches.extend([self.new_entries_sources[key+'_primary_key'][j][x[primary_key]]
-                                        for x in self.new_entries[key]
-                                        if x[primary_key] in self.new_entries_sources[key+'_primary_key'][j]
-                                        and x[primary_key] == duplicates[i][primary_key]])
-                            print("Duplicates found in {0} [\"{1}\"]!  This entry: {2}\nconflicts with {3}".format(
-                                json_name, key, duplicates[i][primary_key], matches))
-                            input("Press Enter to Continue.")
-                    if 'unique_values' in schema and len(schema['unique_values']) > 0:
-                        for i in range(len(schema['unique_values'])):
-                            key_tag = key + '_' + schema['unique_values'][i]
-                            prior_values = [x[schema['unique_values'][i]] for x in self.new_entries[key]]
-                            duplicates = [x for x in json_data[key] if x[schema['unique_values'][i]] in prior_values]
-                            if len(duplicates) > 0:
-                                for i in range(len(duplicates)):
-                                    matches = []
-                                    for j in range(len(self.new_entries_sources[key_tag])):
-                                        matches.extend([self.new_entries_sources[key_tag][j][x[schema['unique_values'][i]]]
-                                            for x in self.new_entries[key]
-                                            if x[schema['unique_values'][i]] in self.new_entries_sources[key_tag][j]
-                                            and x[schema['unique_values'][i]] == duplicates[i][schema['unique_values'][i]]])
-                                    print("Duplicates found in {0} [\"{1}\"]!  This entry: {2}\nconflicts with {3}".format(
-                                        json_name, key, duplicates[i][schema['unique_values'][i]], matches))
-                                input("Press Enter to Continue.")
-                # Insert the primary keys and unique values into self.new_entries_sources so they can be referenced in future calls
+                if len(schema) == 0:
+                    continue
+                indexed_columns = []
                 if 'primary_key' in schema:
-                    primary_key = schema['new_primary_key'] if 'new_primary_key' in schema else schema['primary_key']
-                    if key+'_primary_key' in self.new_entries_sources:
-                        self.new_entries_sources[key+'_primary_key'].extend([{x[primary_key]:json_name}
-                            for x in json_data[key]])
-                    else:
-                        self.new_entries_sources[key+'_primary_key'] = [{x[primary_key]:json_name}
-                            for x in json_data[key]]
-                if 'unique_values' in schema and len(schema['unique_values']) > 0:
-                    for i in range(len(schema['unique_values'])):
-                        key_tag = key + '_' + schema['unique_values'][i]
-                        if key_tag in self.new_entries_sources:
-                            self.new_entries_sources[key_tag].extend([{x[schema['unique_values'][i]]:json_name} for x in json_data[key]])
-                        else:
-                            self.new_entries_sources[key_tag] = [{x[schema['unique_values'][i]]:json_name} for x in json_data[key]]
+                    indexed_columns.append((key+'_primary_key', self.get_codec(key, self.schema_dict[key]).get_primary_key))
+                if 'unique_values' in schema:
+                    indexed_columns.extend([(key+'_'+x, operator.itemgetter(x)) for x in schema['unique_values']])
+                for index_name, get_value in indexed_columns:
+                    if not index_name in self.new_entries_sources:
+                        self.new_entries_sources[index_name] = {}
+                    sources = self.new_entries_sources[index_name]
+                    values = [get_value(x) for x in json_data[key]]
+                    # Search for duplicates and report them
+                    duplicates = [x for x in values if x in sources]
+                    if len(duplicates) > 0:
+                        for value in duplicates:
+                            print("Duplicates found in {0} [\"{1}\"]!  This entry: {2}\nconflicts with {3}".format(
+                                json_name, key, value, sources[value]))
+                        input("Press Enter to Continue.")
+                    # Insert the values into the index so they can be referenced in future calls
+                    for value in values:
+                        if not value in sources:
+                            sources[value] = [json_name]
+                        elif not json_name in sources[value]:
+                            sources[value].append(json_name)
         return
 
     def read_kurodlc_json(self, json_name):
         if os.path.exists(json_name):
-            json_data = self.read_struct_from_json(json_name)
-            self.validate_kurodlc_entries(json_data, json_name)
-            self.detect_duplicate_entries(json_data, json_name)
-            for key in json_data:
-                if key in self.new_entries:
-                    self.new_entries[key].extend(json_data[key])
-                else:
-                    self.new_entries[key] = json_data[key]
+            json_data, cache_key = self.read_kurodlc_cache(json_name)
+            if json_data is False:
+                json_data = self.read_struct_from_json(json_name)
+                self.validate_kurodlc_entries(json_data, json_name)
+                self.write_kurodlc_cache(json_name, cache_key, json_data)
+            self.add_kurodlc_entries(json_data, json_name)
         return
 
-    def read_all_kurodlc_jsons(self):
+    # Mods are cached after validation, so unchanged mods skip JSON decoding and validation.  The cache is
+    # invalidated if the contents of the mod (xxhash64), kurodlc_schema.json, the schema lengths of the tables
+    # the mod adds to, the cache format or the marshal format change.  Returns (json_data or False, cache_key).
+    def read_kurodlc_cache(self, json_name):
+        if self.use_table_cache == False:
+            return(False, None)
+        with open(json_name, 'rb') as f:
+            cache_key = [kurodlc_cache_version, marshal.version, xxhash.xxh64_intdigest(f.read()), self.schema_hash]
+        if os.path.exists(json_name + '.cache'):
+            try:
+                with open(json_name + '.cache', 'rb') as f:
+                    cache = marshal.loads(f.read())
+                if isinstance(cache, dict) and cache.get('key') == cache_key and cache.get('schema_lengths') ==\
+                        [[x, self.schema_dict.get(x)] for x in cache['json_data']]:
+                    return(cache['json_data'], cache_key)
+            except (EOFError, ValueError, TypeError, KeyError):
+                pass # Unreadable cache, it will be replaced
+        return(False, cache_key)
+
+    # json_data must already be validated
+    def write_kurodlc_cache(self, json_name, cache_key, json_data):
+        if cache_key is not None:
+            schema_lengths = [[x, self.schema_dict.get(x)] for x in json_data]
+            try:
+                with open(json_name + '.cache.tmp', 'wb') as f:
+                    f.write(marshal.dumps({'key': cache_key, 'schema_lengths': schema_lengths, 'json_data': json_data}))
+                os.replace(json_name + '.cache.tmp', json_name + '.cache')
+            except (OSError, ValueError):
+                pass # The cache is optional, run without it if the folder is not writable
+        return
+
+    # json_data must already be validated
+    def add_kurodlc_entries(self, json_data, json_name):
+        self.detect_duplicate_entries(json_data, json_name)
+        self.kurodlc_json_sections[json_name] = list(json_data.keys())
+        for key in json_data:
+            self.merged_entries.pop(key, None)
+            if key in self.new_entries:
+                self.new_entries[key].extend(json_data[key])
+            else:
+                self.new_entries[key] = json_data[key]
+        return
+
+    # The .kurodlc.json files are parsed and validated in parallel by up to jobs workers (default is one per
+    # CPU), then checked for duplicates and merged one at a time in alphabetical order, so the result and
+    # every report are the same as loading them sequentially.  Less than kurodlc_parallel_min_size of
+    # .kurodlc.json files in total are read sequentially.
+    def read_all_kurodlc_jsons(self, jobs = None):
         kurodlc_jsons = sorted(glob.glob('*.kurodlc.json'))
-        for i in range(len(kurodlc_jsons)):
-            self.read_kurodlc_json(kurodlc_jsons[i])
+        jobs = get_worker_count(jobs, len(kurodlc_jsons))
+        if jobs <= 1 or sum([os.path.getsize(x) for x in kurodlc_jsons]) < kurodlc_parallel_min_size:
+            for i in range(len(kurodlc_jsons)):
+                self.read_kurodlc_json(kurodlc_jsons[i])
+            return
+        with get_executor(jobs) as executor:
+            results = executor.map(load_kurodlc_json, kurodlc_jsons, [self.schema_dict] * len(kurodlc_jsons),
+                [self.use_table_cache] * len(kurodlc_jsons),
+                chunksize = max(1, len(kurodlc_jsons) // (jobs * 4)))
+            for json_name, json_data, errors in results:
+                if len(errors) > 0:
+                    for error in errors:
+                        print(error)
+                    input("Validation of {0} failed, press Enter to abort.".format(json_name))
+                    raise
+                self.add_kurodlc_entries(json_data, json_name)
         return
 
+    # Reference index of the given decoded tables, with the entries of every .kurodlc.json loaded so far on top
+    def get_reference_index(self, tables = []):
+        reference_index = kuro_reference_index()
+        for table in tables:
+            reference_index.add_sections(table)
+        reference_index.add_sections(self.new_entries)
+        return(reference_index)
+
+    # .kurodlc.json entries of a section with a primary key, as an ordered {primary key: row} dict where
+    # later files replace earlier entries with the same primary key.  Built once per section and kept
+    # until more .kurodlc.json files are loaded.
+    def get_merged_entries(self, key):
+        if not key in self.merged_entries:
+            get_primary_key = self.get_codec(key, self.schema_dict[key]).get_primary_key
+            self.merged_entries[key] = {get_primary_key(x):x for x in self.new_entries.get(key, [])}
+        return(self.merged_entries[key])
+
+    # Ordered {primary key: row} of a table section with the .kurodlc.json entries merged in.  Entries that
+    # replace an original row keep the position of that row, new entries are added at the end.
+    # Only for sections with a primary key, use update_table_with_kurodlc() for other sections.
+    def get_merged_section(self, table, key):
+        get_primary_key = self.get_codec(key, self.schema_dict[key]).get_primary_key
+        merged_section = {get_primary_key(x):x for x in table[key]}
+        merged_section.update(self.get_merged_entries(key))
+        return(merged_section)
+
     def update_table_with_kurodlc(self, table):
         for key in table:
             if key in self.new_entries:
-                table[key].extend(self.new_entries[key])
                 #For tables with primary keys, cull old entries by primary key if new one supercedes them
-                schema = self.get_schema(key, self.schema_dict[key])
-                if 'primary_key' in schema and isinstance(schema['primary_key'], list):
-                    schema['new_primary_key'] = "_".join(schema['primary_key'])
-                    for i in range(len(table[key])):
-                        table[key][i][schema['new_primary_key']] =\
-                            tuple(table[key][i][j] for j in schema['primary_key'] if j in table[key][i])
-                if 'primary_key' in schema:
-                    primary_key = schema['new_primary_key'] if 'new_primary_key' in schema else schema['primary_key']
-                    table[key] = list({table[key][i][primary_key]:table[key][i] for i in range(len(table[key]))}.values())
+                if 'primary_key' in self.get_schema(key, self.schema_dict[key]):
+                    table[key] = list(self.get_merged_section(table, key).values())
+                else:
+                    table[key].extend(self.new_entries[key])
         return(table)
 
-    def read_table(self, table_name):
-        def read_array(offset, numvalues): #u32
-            arr = []
-            f.seek(offset)
-            if numvalues > 0:
-                arr.extend(list(struct.unpack("<{}I".format(numvalues), f.read(numvalues*4))))
-            return(arr)
-        def read_short_array(offset, numvalues): #u16
-            arr = []
-            f.seek(offset)
-            if numvalues > 0:
-                arr.extend(list(struct.unpack("<{}H".format(numvalues), f.read(numvalues*2))))
-            return(arr)
-        def read_null_term_str(offset):
-            f.seek(offset)
-            bstr = f.read(1)
-            while bstr[-1] != 0:
-                bstr += f.read(1)
-            return(bstr[:-1].decode('utf-8'))
-        def decode_row(raw_data, keys, values):
-            i = 0
-            assert len(keys) == len(values)
-            decoded_data = {}
-            for j in range(len(values)):
-                if values[j] == 'n':
-                    decoded_data[keys[j]] = raw_data[i]
-                    i += 1
-                elif values[j] == 'a':
-                    decoded_data[keys[j]] = read_array(raw_data[i], raw_data[i+1])
-                    i += 2
-                elif values[j] == 'b':
-                    decoded_data[keys[j]] = read_short_array(raw_data[i], raw_data[i+1])
-                    i += 2
-                elif values[j] == 't':
-                    decoded_data[keys[j]] = read_null_term_str(raw_data[i])
-                    i += 1
-            return(decoded_data)
+    def read_table_headers(self, data):
+        num_sections, = struct.unpack_from("<I", data, 4)
+        headers = []
+        for i in range(num_sections):
+            header = {}
+            header['name'] = data[8+i*80:72+i*80].replace(b'\x00',b'').decode('utf-8')
+            header['crc'], header['start_offset'], header['entry_length'],\
+                header['num_entries'] = struct.unpack_from("<4I", data, 72+i*80)
+            headers.append(header)
+            if not header['name'] in self.crc_dict:
+                self.crc_dict[header['name']] = header['crc']
+        return(headers)
+
+    # Returns {section name: kuro_section}, sections without a schema are skipped.
+    # If sections is given, only those sections are returned (and checked for schemas).
+    def get_table_sections(self, data, table_name, sections = None):
+        self.missing_schemas = [] #Re-initialize
+        headers = self.read_table_headers(data)
+        tbl_sections = {}
+        for i in range(len(headers)):
+            if sections is not None and not headers[i]['name'] in sections:
+                self.schema_dict[headers[i]['name']] = headers[i]['entry_length']
+                continue
+            schema = self.get_schema(headers[i]['name'], headers[i]['entry_length'])
+            if schema == {}:
+                print("Missing schema: {0}! {1} will not be processed.".format(headers[i]['name'],
+                    os.path.basename(table_name).replace('.original','')))
+                self.missing_schemas.append(headers[i]['name'])
+                continue
+            tbl_sections[headers[i]['name']] = kuro_section(self.get_codec(headers[i]['name'],
+                headers[i]['entry_length']), data, headers[i]['start_offset'], headers[i]['num_entries'])
+        return(tbl_sections)
+
+    # The table is mapped once and every section is unpacked from a single slice of the map.
+    # sections and columns are optional lists of section names / column names to decode, everything
+    # else is skipped.  Columns not present in a section's schema are ignored.
+    # If data (bytes or any other buffer) is given, the table is read from it instead of from the file, and
+    # table_name is only used in messages.  Tables read from memory are not cached.
+    def read_table(self, table_name, sections = None, columns = None, data = None):
         self.missing_schemas = [] #Re-initialize
+        if data is not None:
+            return(self.decode_table(as_table_buffer(data), table_name, sections, columns, use_cache = False))
         with open(table_name, 'rb') as f:
-            magic = f.read(4)
-            if magic == b'#TBL':
-                num_sections, = struct.unpack("<I", f.read(4))
-                headers = []
-                for i in range(num_sections):
-                    header = {}
-                    header['name'] = f.read(64).replace(b'\x00',b'').decode('utf-8')
-                    header['crc'], header['start_offset'], header['entry_length'],\
-                        header['num_entries'] = struct.unpack("<4I", f.read(16))
-                    headers.append(header)
-                    if not header['name'] in self.crc_dict:
-                        self.crc_dict[header['name']] = header['crc']
-                tbl_data = {}
-                for i in range(num_sections):
-                    f.seek(headers[i]['start_offset'])
-                    schema = self.get_schema(headers[i]['name'], headers[i]['entry_length'])
-                    if schema == {}:
-                        print("Missing schema: {0}! {1} will not be processed.".format(headers[i]['name'],
-                            os.path.basename(table_name).replace('.original','')))
-                        self.missing_schemas.append(headers[i]['name'])
-                        continue
-                    raw_data = [struct.unpack(schema['schema'], f.read(schema['sch_len'])) for j in range(headers[i]['num_entries'])]
-                    tbl_data[headers[i]['name']] = [decode_row(x, schema['keys'], schema['values']) for x in raw_data]
-                return(tbl_data)
+            if os.fstat(f.fileno()).st_size < 8:
+                return False # Empty files cannot be mapped
+            with mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ) as data:
+                return(self.decode_table(data, table_name, sections, columns))
+
+    def decode_table(self, data, table_name, sections = None, columns = None, use_cache = True):
+        if data[0:4] == b'#TBL':
+            tbl_sections = self.get_table_sections(data, table_name, sections)
+            cache_key = self.get_table_cache_key(data, table_name) if use_cache == True else None
+            cached_table = self.read_table_cache(table_name, cache_key)
+            if cached_table is not False:
+                return({x:tbl_sections[x].codec.project_rows(cached_table[x], columns) for x in tbl_sections})
+            tbl_data = {x:tbl_sections[x].rows(columns) for x in tbl_sections}
+            if sections is None and columns is None:
+                self.write_table_cache(table_name, cache_key, tbl_data)
+            return(tbl_data)
         return False # Failed to read table properly
 
-    def write_table(self, table_name):
-        def write_array(data_list): #u32
-            self.data2_buffer += struct.pack("<{}I".format(len(data_list)), *data_list)
-        def write_short_array(data_list): #u16
-            self.data2_buffer += struct.pack("<{}H".format(len(data_list)), *data_list)
-        def write_null_term_str(string):
-            self.data2_buffer += string.encode('utf-8') + b'\x00'
+    # Only .tbl.original files are cached, as they are not supposed to change.  The cache is invalidated
+    # if the contents of the table (xxhash64), kurodlc_schema.json, the cache format or the marshal format
+    # change.  Only full reads (no section / column selection) are written to the cache.
+    def get_table_cache_key(self, data, table_name):
+        if self.use_table_cache == True and table_name.endswith('.original'):
+            return([table_cache_version, marshal.version, xxhash.xxh64_intdigest(data), self.schema_hash])
+        return(None)
+
+    def read_table_cache(self, table_name, cache_key):
+        if cache_key is not None and os.path.exists(table_name + '.cache'):
+            try:
+                with open(table_name + '.cache', 'rb') as f:
+                    cache = marshal.loads(f.read())
+                if isinstance(cache, dict) and cache.get('key') == cache_key:
+                    return(cache['table'])
+            except (EOFError, ValueError, TypeError):
+                pass # Unreadable cache, it will be replaced
+        return False
+
+    def write_table_cache(self, table_name, cache_key, tbl_data):
+        if cache_key is not None:
+            cache = marshal.dumps({'key': cache_key, 'table': tbl_data})
+            try:
+                if len(cache) <= table_cache_max_size:
+                    with open(table_name + '.cache.tmp', 'wb') as f:
+                        f.write(cache)
+                    os.replace(table_name + '.cache.tmp', table_name + '.cache')
+                elif os.path.exists(table_name + '.cache'):
+                    os.remove(table_name + '.cache')
+            except OSError:
+                pass # The cache is optional, run without it if the folder is not writable
+        return
+
+    # Columnar alternative to read_table, rows are only decoded when requested from each kuro_section
+    def read_table_sections(self, table_name, sections = None):
+        self.missing_schemas = [] #Re-initialize
+        with open(table_name, 'rb') as f:
+            data = f.read()
+        if data[0:4] == b'#TBL':
+            return(self.get_table_sections(data, table_name, sections))
+        return False # Failed to read table properly
+
+    # Compares two decoded tables (e.g. the original and a modded one) section by section, rows are matched by
+    # fingerprint so the cost is linear in the number of rows.  Returns {section: diff}, where diff['rows'] are
+    # the rows of new_tbl_data that are not in orig_tbl_data (in table order), and for sections with a primary
+    # key diff['added'], diff['modified'] and diff['removed'] are lists of primary keys.
+    def diff_table(self, orig_tbl_data, new_tbl_data):
+        table_diff = {}
+        for key in [x for x in orig_tbl_data if x in new_tbl_data]:
+            codec = self.get_codec(key, self.schema_dict[key])
+            orig_fingerprints = set([codec.get_fingerprint(x) for x in orig_tbl_data[key]])
+            diff = {'rows': [x for x in new_tbl_data[key] if not codec.get_fingerprint(x) in orig_fingerprints],
+                'added': [], 'modified': [], 'removed': []}
+            if codec.get_primary_key is not None:
+                orig_keys = set([codec.get_primary_key(x) for x in orig_tbl_data[key]])
+                new_keys = set([codec.get_primary_key(x) for x in new_tbl_data[key]])
+                for row in diff['rows']:
+                    primary_key = codec.get_primary_key(row)
+                    diff['modified' if primary_key in orig_keys else 'added'].append(primary_key)
+                diff['removed'] = [codec.get_primary_key(x) for x in orig_tbl_data[key]
+                    if not codec.get_primary_key(x) in new_keys]
+            table_diff[key] = diff
+        return(table_diff)
+
+    # Diffs table.tbl against table.tbl.original (table is the name without extension)
+    def diff_table_files(self, table):
+        return(self.diff_table(self.read_table(table + '.tbl.original'), self.read_table(table + '.tbl')))
+
+    # diff_table_files() for every table in tables, using up to jobs worker processes (default is one per CPU).
+    # Returns {table: diff_table() result}.
+    def diff_tables(self, tables, jobs = None):
+        jobs = get_worker_count(jobs, len(tables))
+        if jobs <= 1:
+            return({x:self.diff_table_files(x) for x in tables})
+        with get_executor(jobs) as executor:
+            return(dict(zip(tables, executor.map(diff_table_worker, tables))))
+
+    # Fills in the file header and section headers at the start of new_table.
+    # sections is a list of (name, section offset, number of entries) in file order.
+    def write_table_headers(self, new_table, sections):
         def return_64_len_str(string):
             assert len(string) <= 64
             return(string.encode('utf-8') + b'\x00'*(64-len(string)))
-        def encode_row(raw_data, schema_table):
-            encoded_data = []
-            for key in raw_data:
-                if 'new_primary_key' in schema_table and key == schema_table['new_primary_key']:
-                    continue # Do not encode the temporary tuple used to identify unique rows
-                if isinstance(raw_data[key], str):
-                    data_offset = len(self.data2_buffer)
-                    write_null_term_str(raw_data[key])
-                    encoded_data.append(data_offset + self.data2_start_offset)
-                elif isinstance(raw_data[key], list):
-                    data_type = schema_table['values'][schema_table['keys'].index(key)]
-                    if data_type == 'a':
-                        #32-bit alignment
-                        while len(self.data2_buffer) % 4 > 0:
-                            self.data2_buffer += b'\x00'
-                        data_offset = len(self.data2_buffer)
-                        write_array(raw_data[key])
-                    elif data_type == 'b':
-                        #16-bit alignment
-                        while len(self.data2_buffer) % 2 > 0:
-                            self.data2_buffer += b'\x00'
-                        data_offset = len(self.data2_buffer)
-                        write_short_array(raw_data[key])
-                    else:
-                        input("Error, data type \"{}\" is not an array as expected, press Enter to quit!")
-                        raise
-                    encoded_data.extend([data_offset + self.data2_start_offset, len(raw_data[key])])
-                else:
-                    encoded_data.append(raw_data[key])
-            return(encoded_data)
-        if os.path.exists(table_name) and not os.path.exists(table_name+'.original'):
+        new_table[0:8] = b'#TBL' + struct.pack("<I", len(sections))
+        for i in range(len(sections)):
+            name, offset, num_entries = sections[i]
+            new_table[8+i*80:88+i*80] = return_64_len_str(name) + struct.pack("<4I",
+                self.crc_dict[name], offset, self.schema_dict[name], num_entries)
+        return
+
+    def encode_rows(self, new_table, offset, codec, rows, data2):
+        for x in rows:
+            codec.encode_row(new_table, offset, x, data2.write_array, data2.write_short_array, data2.write_null_term_str)
+            offset += codec.struct.size
+        return
+
+    # The fixed-length part of the table is preallocated and packed in place, strings and arrays are
+    # appended to a single bytearray, so the cost is linear in the size of the table.
+    # If pool_data is True, identical strings and arrays are only written once and share an offset.
+    # If incremental is True, see encode_table_incremental().
+    # If data (the original table as bytes) is given, nothing is read from or written to disk and the new table
+    # is returned as a bytearray instead (or None if the table cannot be written).
+    def write_table(self, table_name, pool_data = False, incremental = False, data = None):
+        if data is None and os.path.exists(table_name) and not os.path.exists(table_name+'.original'):
             shutil.copy2(table_name, table_name+'.original')
-        table = self.read_table(table_name+'.original')
-        if len(self.missing_schemas) > 0:
+        if incremental == True:
+            new_table = self.encode_table_incremental(table_name, pool_data, data)
+        else:
+            new_table = self.encode_table(table_name, pool_data, data)
+        if data is not None:
+            return(new_table)
+        if new_table is not None:
+            with open(table_name, 'wb') as f:
+                f.write(new_table)
+        return
+
+    # Writes several tables in one go.  The .original copies are all made first, then the tables are encoded
+    # by up to jobs worker processes (default is one per CPU), largest first.  The workers receive the schemas
+    # and the merged .kurodlc.json entries of this instance once, when they start, and each new table is written
+    # by this process in the order of table_names.
+    def write_tables(self, table_names, pool_data = False, incremental = False, jobs = None):
+        for table_name in table_names:
+            if os.path.exists(table_name) and not os.path.exists(table_name+'.original'):
+                shutil.copy2(table_name, table_name+'.original')
+        jobs = get_worker_count(jobs, len(table_names))
+        if jobs <= 1:
+            for table_name in table_names:
+                self.write_table(table_name, pool_data = pool_data, incremental = incremental)
+            return
+        with get_executor(jobs, initializer = init_table_worker,
+                initargs = (self.schema_dict, self.crc_dict, self.new_entries, self.use_table_cache)) as executor:
+            futures = {x:executor.submit(encode_table_worker, x, pool_data, incremental) for x in
+                sorted(table_names, key = lambda x: os.path.getsize(x+'.original'), reverse = True)}
+            for table_name in table_names:
+                new_table = futures[table_name].result()
+                if new_table is not None:
+                    with open(table_name, 'wb') as f:
+                        f.write(new_table)
+        return
+
+    # Returns the new table as a bytearray, or None if the table cannot be written.  The original is read from
+    # table_name.original unless data is given.
+    def encode_table(self, table_name, pool_data = False, data = None):
+        table = self.read_table(table_name+'.original', data = data)
+        if table is False or len(self.missing_schemas) > 0:
             return # Do not attempt to write to table with missing schemas
         table = self.update_table_with_kurodlc(table)
-        new_table = b'#TBL' + struct.pack("<I", len(table))
         offset = 8 + len(table) * 80
+        sections = []
         for key in table:
-            new_table += return_64_len_str(key) + struct.pack("<4I", self.crc_dict[key], offset,\
-                self.schema_dict[key], len(table[key]))
+            sections.append((key, offset, len(table[key])))
             offset += self.schema_dict[key] *  len(table[key])
         #Need 32-bit alignment here?  Or per table?
         #Will ignore for now, t_costume/t_dlc/t_item are all naturally aligned
-        self.data2_start_offset = offset
-        self.data2_buffer = b''
-        for key in table:
-            schema_table = self.get_schema(key, self.schema_dict[key])
-            new_table += b''.join([struct.pack(schema_table['schema'],\
-                *encode_row(x, schema_table)) for x in table[key]])
-        assert self.data2_start_offset == len(new_table)
-        new_table += self.data2_buffer
-        with open(table_name, 'wb') as f:
-            f.write(new_table)
-        return
+        data2 = kuro_data2_writer(offset, pool_data)
+        new_table = bytearray(data2.start_offset)
+        self.write_table_headers(new_table, sections)
+        for key, offset, num_entries in sections:
+            self.encode_rows(new_table, offset, self.get_codec(key, self.schema_dict[key]), table[key], data2)
+        new_table += data2.buffer
+        if pool_data == True:
+            layout_problems = self.verify_table_layout(new_table)
+            if len(layout_problems) > 0:
+                print("Pooled {0} failed layout verification, writing without pooling:".format(table_name))
+                for problem in layout_problems[:10]:
+                    print(problem)
+                return(self.encode_table(table_name, data = data))
+        return(new_table)
+
+    # Only the sections that have new entries from .kurodlc.json files are decoded and re-encoded.  The rows
+    # of every other section are copied verbatim, and the original string / array region is copied as a
+    # single block after the rows; pointers of the copied rows are shifted by the distance it moved.  The
+    # strings and arrays of the re-encoded sections are appended after it.  The copy is placed at the same
+    # position modulo 8 as in the original, so the alignment of the original arrays is preserved.
+    # The output decodes to the same table as encode_table(), but is not byte-identical to it.
+    def encode_table_incremental(self, table_name, pool_data = False, data = None):
+        if data is not None:
+            data = as_table_buffer(data)
+        in_memory_data = data
+        if data is None:
+            with open(table_name+'.original', 'rb') as f:
+                data = f.read()
+        if not data[0:4] == b'#TBL':
+            return
+        tbl_sections = self.get_table_sections(data, table_name+'.original')
+        if len(self.missing_schemas) > 0:
+            return # Do not attempt to write to table with missing schemas
+        headers = self.read_table_headers(data)
+        changed_sections = [x for x in tbl_sections if x in self.new_entries and len(self.new_entries[x]) > 0]
+        table = self.update_table_with_kurodlc(self.read_table(table_name+'.original', sections = changed_sections,
+            data = in_memory_data))
+        old_data2_start = max([8 + len(headers) * 80] + [x['start_offset'] + x['entry_length'] * x['num_entries'] for x in headers])
+        offset = 8 + len(headers) * 80
+        sections = []
+        for header in headers:
+            num_entries = len(table[header['name']]) if header['name'] in table else header['num_entries']
+            sections.append((header['name'], offset, num_entries))
+            offset += header['entry_length'] * num_entries
+        data2_copy_offset = offset + (old_data2_start - offset) % 8
+        pointer_shift = data2_copy_offset - old_data2_start
+        data2 = kuro_data2_writer(data2_copy_offset + len(data) - old_data2_start
+            + -(len(data) - old_data2_start) % 4, pool_data)
+        new_table = bytearray(data2.start_offset)
+        self.write_table_headers(new_table, sections)
+        new_table[data2_copy_offset:data2_copy_offset + len(data) - old_data2_start] = data[old_data2_start:]
+        for key, offset, num_entries in sections:
+            codec = tbl_sections[key].codec
+            if key in table:
+                self.encode_rows(new_table, offset, codec, table[key], data2)
+            else:
+                pointer_slots = [codec.slots[x][1] for x in codec.keys if not codec.slots[x][0] == 'n']
+                if len(pointer_slots) == 0:
+                    new_table[offset:offset + num_entries * codec.struct.size] = tbl_sections[key].get_block()
+                else:
+                    for raw_row in tbl_sections[key].get_raw_rows():
+                        raw_row = list(raw_row)
+                        for i in pointer_slots:
+                            if raw_row[i] >= old_data2_start:
+                                raw_row[i] += pointer_shift
+                        codec.struct.pack_into(new_table, offset, *raw_row)
+                        offset += codec.struct.size
+        new_table += data2.buffer
+        if pool_data == True:
+            layout_problems = self.verify_table_layout(new_table, data2_start = data2_copy_offset)
+            if len(layout_problems) > 0:
+                print("Pooled {0} failed layout verification, writing without pooling:".format(table_name))
+                for problem in layout_problems[:10]:
+                    print(problem)
+                return(self.encode_table_incremental(table_name, data = in_memory_data))
+        return(new_table)
+
+    # Checks that every string and array pointer in an encoded table lands inside the data region, that
+    # strings are null-terminated and that u32 ('a') / u16 ('b') arrays keep the 4 / 2 byte alignment
+    # (relative to the start of the data region) that write_table() gives them.
+    # data2_start defaults to the end of the last section.  Returns a list of problems, which is empty if
+    # the layout is valid.
+    def verify_table_layout(self, data, data2_start = None):
+        headers = self.read_table_headers(data)
+        if data2_start is None:
+            data2_start = max([8 + len(headers) * 80] + [x['start_offset'] + x['entry_length'] * x['num_entries'] for x in headers])
+        problems = []
+        for header in headers:
+            if self.get_schema(header['name'], header['entry_length']) == {}:
+                continue
+            codec = self.get_codec(header['name'], header['entry_length'])
+            pointer_slots = [(key, codec.slots[key]) for key in codec.keys if not codec.slots[key][0] == 'n']
+            if len(pointer_slots) == 0:
+                continue
+            section = kuro_section(codec, data, header['start_offset'], header['num_entries'])
+            raw_rows = section.get_raw_rows()
+            for j in range(len(raw_rows)):
+                for key, (value_type, i) in pointer_slots:
+                    offset = raw_rows[j][i]
+                    if value_type == 't':
+                        if not (data2_start <= offset < len(data)) or data.find(b'\x00', offset) == -1:
+                            problems.append("{0}[{1}]['{2}']: string at {3} is out of bounds".format(header['name'], j, key, offset))
+                    else:
+                        item_size = {'a': 4, 'b': 2}[value_type]
+                        if not (data2_start <= offset and offset + raw_rows[j][i+1] * item_size <= len(data)):
+                            problems.append("{0}[{1}]['{2}']: array at {3} is out of bounds".format(header['name'], j, key, offset))
+                        elif (offset - data2_start) % item_size > 0:
+                            problems.append("{0}[{1}]['{2}']: array at {3} is not {4}-byte aligned".format(header['name'],
+                                j, key, offset, item_size))
+        return(problems)
+
+# Tables in memory are sliced and searched (find / replace), which memoryviews and other buffers do not support
+def as_table_buffer(data):
+    if isinstance(data, (bytes, bytearray, mmap.mmap)):
+        return(data)
+    return(bytes(data))
+
+# Number of worker processes for num_tasks tasks, jobs is one per CPU if not given
+def get_worker_count(jobs, num_tasks):
+    if jobs is None:
+        jobs = os.cpu_count() or 1
+    if max_process_workers is not None:
+        jobs = min(jobs, max_process_workers)
+    return(min(jobs, num_tasks))
+
+# Pool of jobs worker processes, or of threads in frozen executables, which cannot start worker processes without
+# multiprocessing.freeze_support().  kwargs (e.g. initializer / initargs) are passed on to the executor.
+def get_executor(jobs, **kwargs):
+    if getattr(sys, 'frozen', False):
+        return(concurrent.futures.ThreadPoolExecutor(max_workers = jobs, **kwargs))
+    return(concurrent.futures.ProcessPoolExecutor(max_workers = jobs, **kwargs))
+
+# Workers for kuro_tables.write_tables(), each worker gets its own kuro_tables instance holding the schemas
+# and merged .kurodlc.json entries of the parent.  It is thread-local, as the workers are threads in frozen
+# executables (see get_executor()).
+table_worker = threading.local()
+
+def init_table_worker(schema_dict, crc_dict, new_entries, use_table_cache):
+    table_worker.kt = kuro_tables(table_roots = [], use_table_cache = use_table_cache)
+    table_worker.kt.schema_dict.update(schema_dict)
+    table_worker.kt.crc_dict.update(crc_dict)
+    table_worker.kt.new_entries = new_entries
+    return
+
+def encode_table_worker(table_name, pool_data, incremental):
+    if incremental == True:
+        return(table_worker.kt.encode_table_incremental(table_name, pool_data))
+    return(table_worker.kt.encode_table(table_name, pool_data))
+
+# Worker for kuro_tables.diff_tables(), reads table.tbl.original and table.tbl with its own kuro_tables instance
+def diff_table_worker(table):
+    return(kuro_tables(table_roots = []).diff_table_files(table))
+
+# Worker for kuro_tables.read_all_kurodlc_jsons(), reads and validates a .kurodlc.json file without user
+# interaction.  Returns (json_name, validated json_data, list of error messages).
+def load_kurodlc_json(json_name, schema_dict, use_cache = True):
+    kt = kuro_tables(table_roots = [], use_table_cache = use_cache)
+    kt.schema_dict.update(schema_dict)
+    json_data, cache_key = kt.read_kurodlc_cache(json_name)
+    if json_data is not False:
+        return(json_name, json_data, [])
+    with open(json_name, 'r', encoding='utf-8') as f:
+        try:
+            json_data = json.loads(f.read())
+        except json.JSONDecodeError as e:
+            return(json_name, None, ["Decoding error when trying to read JSON file {0}!\r\n".format(json_name),
+                "{0} at line {1} column {2} (character {3})\r\n".format(e.msg, e.lineno, e.colno, e.pos)])
+    errors = kt.get_kurodlc_validation_errors(json_data, json_name)
+    if len(errors) == 0:
+        kt.write_kurodlc_cache(json_name, cache_key, json_data)
+    return(json_name, json_data, errors)
 
 if __name__ == "__main__":
     pass
\ No newline at end of file
@@ -86,7 +86,8 @@ class dlc_table_maker:
     #Takes NameTableData.csv from tbled
     def get_names (self):
         if os.path.exists('t_name.tbl'):
-            t_name = self.kt.read_table('t_name.tbl')
+            t_name = self.kt.read_table('t_name.tbl', sections = ['NameTableData', 'SNameTable'],
+                columns = ['model', 'char_id', 'name'])
             if self.game_type in ['kuro', 'sky']:
                 name_dict = {x['model']:{'char_id': x['char_id'], 'name': x['name']}\
                     for x in t_name['NameTableData'] if x['char_id'] < 200}
@@ -270,9 +271,11 @@ class dlc_table_maker:
                 if store_opt == 'y':
                     if os.path.exists('t_shop.tbl') or os.path.exists('t_shop.tbl.original'):
                         if os.path.exists('t_shop.tbl'):
-                            shop_info = self.kt.read_table('t_shop.tbl')['ShopInfo']
+                            shop_info = self.kt.read_table('t_shop.tbl', sections = ['ShopInfo'],
+                                columns = ['id', 'shop_name'])['ShopInfo']
                         else:
-                            shop_info = self.kt.read_table('t_shop.tbl.original')['ShopInfo']
+                            shop_info = self.kt.read_table('t_shop.tbl.original', sections = ['ShopInfo'],
+                                columns = ['id', 'shop_name'])['ShopInfo']
                         valid_stores = [x['id'] for x in shop_info]
                         need_list = input("Would you like a list of stores? (y/N) ")
                         if not need_list == '':
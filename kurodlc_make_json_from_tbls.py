@@ -26,16 +26,20 @@ if __name__ == "__main__":
     kt = kuro_tables()
 
     kurodlc_json = {}
-    for table in ['t_costume', 't_dlc', 't_item', 't_recipe', 't_shop', 't_skill', 't_voice']:
-        new_tbl, orig_tbl = table + '.tbl', table + '.tbl.original'
-        if os.path.exists(new_tbl) and os.path.exists(orig_tbl):
-            orig_tbl_data = kt.read_table(orig_tbl)
-            new_tbl_data = kt.read_table(new_tbl)
-            for subtable in orig_tbl_data:
-                diff_entries = [x for x in new_tbl_data[subtable]
-                    if not x in orig_tbl_data[subtable]]
-                if len(diff_entries) > 0:
-                    kurodlc_json[subtable] = diff_entries
+    tables = [x for x in ['t_costume', 't_dlc', 't_item', 't_recipe', 't_shop', 't_skill', 't_voice']
+        if os.path.exists(x + '.tbl') and os.path.exists(x + '.tbl.original')]
+    table_diffs = kt.diff_tables(tables)
+    for table in tables:
+        for subtable in table_diffs[table]:
+            diff = table_diffs[table][subtable]
+            if len(diff['rows']) > 0:
+                kurodlc_json[subtable] = diff['rows']
+            if len(diff['added']) + len(diff['modified']) + len(diff['removed']) > 0:
+                print("{0}: {1} new, {2} modified, {3} removed entries.".format(subtable,
+                    len(diff['added']), len(diff['modified']), len(diff['removed'])))
+            if len(diff['removed']) > 0:
+                print("Entries removed from {0} cannot be stored in a .kurodlc.json and will be ignored: {1}".format(
+                    subtable, ", ".join([str(x) for x in diff['removed'][:10]]) + (", ..." if len(diff['removed']) > 10 else "")))
     if len(kurodlc_json) > 0:
         json_name = input("Please input name for .kurodlc.json file (e.g. \"my_mod\" for \"my_mod.kurodlc.json\") ")
         valid = '-_.[]() abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
@@ -23,23 +23,25 @@ if __name__ == "__main__":
     else:
         os.chdir(os.path.abspath(os.path.dirname(__file__)))
 
+    pool_data, incremental, jobs = False, False, None
+    if len(sys.argv) > 1:
+        import argparse
+        parser = argparse.ArgumentParser()
+        parser.add_argument('-p', '--pool_data', help="Store identical strings and arrays only once (smaller tables)",
+            action="store_true")
+        parser.add_argument('-i', '--incremental', help="Only re-encode table sections that have new entries",
+            action="store_true")
+        parser.add_argument('-j', '--jobs', help="Number of tables to build at the same time (default: one per CPU)",
+            type=int)
+        args = parser.parse_args()
+        pool_data, incremental, jobs = args.pool_data, args.incremental, args.jobs
+
     kt = kuro_tables()
     
     # Read *.kurodlc.json files
-    kt.read_all_kurodlc_jsons()
+    kt.read_all_kurodlc_jsons(jobs = jobs)
     
     # Write the new tables
-    if os.path.exists('t_costume.tbl') or os.path.exists('t_costume.tbl.original'):
-        kt.write_table('t_costume.tbl')
-    if os.path.exists('t_dlc.tbl') or os.path.exists('t_dlc.tbl.original'):
-        kt.write_table('t_dlc.tbl')
-    if os.path.exists('t_item.tbl') or os.path.exists('t_item.tbl.original'):
-        kt.write_table('t_item.tbl')
-    if os.path.exists('t_recipe.tbl') or os.path.exists('t_recipe.tbl.original'):
-        kt.write_table('t_recipe.tbl')
-    if os.path.exists('t_shop.tbl') or os.path.exists('t_shop.tbl.original'):
-        kt.write_table('t_shop.tbl')
-    if os.path.exists('t_skill.tbl') or os.path.exists('t_skill.tbl.original'):
-        kt.write_table('t_skill.tbl')
-    if os.path.exists('t_voice.tbl') or os.path.exists('t_voice.tbl.original'):
-        kt.write_table('t_voice.tbl')
+    tables = ['t_costume.tbl', 't_dlc.tbl', 't_item.tbl', 't_recipe.tbl', 't_shop.tbl', 't_skill.tbl', 't_voice.tbl']
+    kt.write_tables([x for x in tables if os.path.exists(x) or os.path.exists(x+'.original')],
+        pool_data = pool_data, incremental = incremental, jobs = jobs)
@@ -9,48 +9,134 @@
 # GitHub eArmada8/kuro_dlc_tool
 
 try:
-    import glob, os, sys
-    from kurodlc_lib import kuro_tables
-    from p3a_lib import p3a_class
+    import glob, json, os, sys
+    import xxhash
+    from kurodlc_lib import kuro_tables, schema_registry
+    from p3a_lib import p3a_class, p3a_reader
 except ModuleNotFoundError as e:
     print("Python module missing! {}".format(e.msg))
     input("Press Enter to abort.")
     raise   
 
-def create_combined_tables_p3a (p3as_to_extract, new_p3a_filename = 'zzz_combined_tables.p3a'):
+manifest_version = 1
+
+def get_file_hash (filename):
+    with open(filename, 'rb') as f:
+        return(xxhash.xxh64_intdigest(f.read()))
+
+# The manifest (zzz_combined_tables.manifest.json) records the source p3a entry, schema and .kurodlc.json files
+# that each table in new_p3a_filename was built from.  It is only trusted if new_p3a_filename has not been
+# changed since it was written.
+def read_manifest (new_p3a_filename, manifest_filename):
+    if os.path.exists(manifest_filename) and os.path.exists(new_p3a_filename):
+        try:
+            with open(manifest_filename, 'r', encoding='utf-8') as f:
+                manifest = json.loads(f.read())
+            stat = os.stat(new_p3a_filename)
+            if manifest['version'] == manifest_version and manifest['schema_hash'] == schema_registry.schema_hash\
+                    and manifest['p3a'] == [stat.st_size, stat.st_mtime_ns]:
+                return(manifest)
+        except (json.JSONDecodeError, KeyError, TypeError):
+            pass # Unreadable manifest, everything will be rebuilt
+    return({})
+
+# With incremental = True, only the tables whose source entry, .kurodlc.json files or schema changed since the last
+# build are written and compressed again; the compressed data of the other tables is copied from the existing
+# new_p3a_filename.  If nothing changed at all, new_p3a_filename is left untouched.
+def create_combined_tables_p3a (p3as_to_extract, new_p3a_filename = 'zzz_combined_tables.p3a', incremental = True):
     p3a = p3a_class()
+    manifest_filename = os.path.splitext(new_p3a_filename)[0] + '.manifest.json'
+    schema_registry.load()
     entries_to_extract = []
+    files_to_extract = ['t_costume.tbl', 't_dlc.tbl', 't_item.tbl', 't_recipe.tbl', 't_shop.tbl', 't_skill.tbl', 't_voice.tbl', 't_name.tbl']
+    readers = {x:p3a_reader(x) for x in p3as_to_extract}
     for i in range(len(p3as_to_extract)):
-        with open(p3as_to_extract[i],'rb') as p3a.f:
-            headers, entries, p3a_dict = p3a.read_p3a_toc()
-            files_to_extract = ['t_costume.tbl', 't_dlc.tbl', 't_item.tbl', 't_recipe.tbl', 't_shop.tbl', 't_skill.tbl', 't_voice.tbl', 't_name.tbl']
-            current_p3a_entries_to_extract = []
-            for filename in files_to_extract:
-                current_p3a_entries_to_extract.extend([entry for entry in entries if os.path.basename(filename) == os.path.basename(entry['name'])])
-            for i in range(len(current_p3a_entries_to_extract)):
-                file_data = p3a.read_file(current_p3a_entries_to_extract[i], p3a_dict)
-                if len(file_data) > 0:
-                    if not os.path.exists(os.path.dirname(current_p3a_entries_to_extract[i]['name'])):
-                        os.makedirs(os.path.dirname(current_p3a_entries_to_extract[i]['name']))
-                    with open(current_p3a_entries_to_extract[i]['name'], 'wb') as f2:
-                        f2.write(file_data)
-            entries_to_extract.extend(current_p3a_entries_to_extract)
-    all_temporary_folders = sorted(list(set([os.path.dirname(x['name']) for x in entries_to_extract])))
+        for filename in files_to_extract:
+            for entry in readers[p3as_to_extract[i]].find(filename):
+                entry['p3a'] = p3as_to_extract[i]
+                entries_to_extract.append(entry)
+    filenames_to_process = [x['name'] for x in entries_to_extract]
+    source_hashes = {x['name']:[x['p3a'], x['cmp_type'], x['cmp_hash'], x['unc_size']] for x in entries_to_extract}
+    json_hashes = {x:get_file_hash(x) for x in sorted(glob.glob('*.kurodlc.json'))}
+    manifest = read_manifest(new_p3a_filename, manifest_filename) if incremental == True else {}
+    if len(manifest) > 0 and manifest['jsons'] == json_hashes\
+            and {x:manifest['tables'][x]['source'] for x in manifest['tables']} == source_hashes:
+        print("{} is already up to date.".format(new_p3a_filename))
+        for reader in readers.values():
+            reader.close()
+        return
+    # The tables are extracted, merged, encoded and packed in memory, no temporary files are written
+    original_tables = {}
+    for i in range(len(entries_to_extract)):
+        file_data = readers[entries_to_extract[i]['p3a']].read(entries_to_extract[i])
+        if len(file_data) > 0:
+            original_tables[entries_to_extract[i]['name']] = file_data
+    for reader in readers.values():
+        reader.close()
+    entries_to_extract = [x for x in entries_to_extract if x['name'] in original_tables]
     filenames_to_process = [x['name'] for x in entries_to_extract]
-    kt = kuro_tables()
+    kt = kuro_tables(table_roots = [])
+    for table_filename in sorted(original_tables):
+        kt.register_table_headers(original_tables[table_filename])
     # Read *.kurodlc.json files
     kt.read_all_kurodlc_jsons()
+    def get_table_jsons(table_data):
+        sections = [x['name'] for x in kt.read_table_headers(table_data)]
+        return({x:json_hashes[x] for x in kt.kurodlc_json_sections if x in json_hashes\
+            and len(set(kt.kurodlc_json_sections[x]).intersection(sections)) > 0})
+    # Compressed data from the previous build, for tables whose inputs have not changed
+    old_entries, precompressed, new_manifest_tables = [], {}, {}
+    if len(manifest) > 0:
+        with p3a_reader(new_p3a_filename) as old_p3a:
+            old_entries = dict(old_p3a.names)
+            for table_filename in filenames_to_process:
+                if table_filename in manifest['tables'] and table_filename.lower() in old_entries:
+                    old_table = manifest['tables'][table_filename]
+                    table_jsons = get_table_jsons(original_tables[table_filename])
+                    old_entry = old_entries[table_filename.lower()]
+                    if old_table['source'] == source_hashes[table_filename] and old_table['jsons'] == table_jsons\
+                            and old_table['output'] == [old_entry['cmp_type'], old_entry['cmp_hash'], old_entry['unc_size']]:
+                        cmp_data = old_p3a.read_cmp_data(old_entry)
+                        if cmp_data is not None:
+                            precompressed[table_filename] = {'cmp_type': old_entry['cmp_type'], 'cmp_data': cmp_data,
+                                'unc_size': old_entry['unc_size'], 'unc_hash': old_table['unc_hash']}
+                            new_manifest_tables[table_filename] = old_table
+    if len(precompressed) > 0:
+        print("Reusing {0} unchanged tables from {1}.".format(len(precompressed), new_p3a_filename))
+    new_tables = {}
     for table_filename in filenames_to_process:
-        kt.write_table(table_filename)
-    assigned_paths = {filenames_to_process[i]:entries_to_extract[i]['name'] for i in range(len(filenames_to_process))}
-    new_p3a = p3a.p3a_pack_files(filenames_to_process, assigned_paths = assigned_paths)
-    with open(new_p3a_filename, 'wb') as f2:
-        f2.write(new_p3a)
-    files_to_remove = filenames_to_process + [x+'.original' for x in filenames_to_process]
-    for file in files_to_remove:
-        os.remove(file)
-    for folder in all_temporary_folders:
-        os.rmdir(folder)
+        if not table_filename in precompressed:
+            new_tables[table_filename] = kt.write_table(table_filename, data = original_tables[table_filename])
+            if new_tables[table_filename] is None:
+                new_tables[table_filename] = original_tables[table_filename] # Table could not be updated
+    if len(precompressed) < len(filenames_to_process) or [x.lower() for x in filenames_to_process] != list(old_entries):
+        assigned_paths = {filenames_to_process[i]:entries_to_extract[i]['name'] for i in range(len(filenames_to_process))}
+        try:
+            with open(new_p3a_filename + '.tmp', 'wb') as f2:
+                p3a.p3a_write_files(f2, filenames_to_process, assigned_paths = assigned_paths, precompressed = precompressed,
+                    payloads = new_tables)
+        except BaseException:
+            if os.path.exists(new_p3a_filename + '.tmp'): # Do not leave a partial archive behind
+                os.remove(new_p3a_filename + '.tmp')
+            raise
+        os.replace(new_p3a_filename + '.tmp', new_p3a_filename)
+    else:
+        print("Tables are unchanged, {} is already up to date.".format(new_p3a_filename))
+    # Record what every table was built from
+    with p3a_reader(new_p3a_filename) as new_p3a:
+        new_entries = dict(new_p3a.names)
+    for table_filename in filenames_to_process:
+        if not table_filename in new_manifest_tables:
+            new_entry = new_entries[table_filename.lower()]
+            new_manifest_tables[table_filename] = {'source': source_hashes[table_filename],
+                'jsons': get_table_jsons(original_tables[table_filename]),
+                'output': [new_entry['cmp_type'], new_entry['cmp_hash'], new_entry['unc_size']],
+                'unc_hash': xxhash.xxh64_intdigest(new_tables[table_filename])}
+    stat = os.stat(new_p3a_filename)
+    with open(manifest_filename, 'wb') as f2:
+        f2.write(json.dumps({'version': manifest_version, 'schema_hash': schema_registry.schema_hash,
+            'p3a': [stat.st_size, stat.st_mtime_ns], 'jsons': json_hashes, 'tables': new_manifest_tables},
+            indent=4).encode("utf-8"))
 
 if __name__ == "__main__":
     # Set current directory
@@ -59,7 +145,16 @@ if __name__ == "__main__":
     else:
         os.chdir(os.path.abspath(os.path.dirname(__file__)))
 
+    incremental = True
+    if len(sys.argv) > 1:
+        import argparse
+        parser = argparse.ArgumentParser()
+        parser.add_argument('-f', '--full', help="Rebuild every table, even if its inputs have not changed",
+            action="store_true")
+        args = parser.parse_args()
+        incremental = not args.full
+
     original_p3as = ['script_en.p3a', 'script_eng.p3a', 'script.p3a', 'misc.p3a']
     p3as_to_extract = [os.path.basename(x) for x in glob.glob('*.p3a') if os.path.basename(x) in original_p3as]
     if len(p3as_to_extract) > 0:
-        create_combined_tables_p3a(p3as_to_extract)
+        create_combined_tables_p3a(p3as_to_extract, incremental = incremental)
@@ -10,7 +10,7 @@
 
 try:
     import os, sys
-    from kurodlc_lib import kuro_tables
+    from kurodlc_lib import kuro_tables, kuro_reference_index
 except ModuleNotFoundError as e:
     print("Python module missing! {}".format(e.msg))
     input("Press Enter to abort.")
@@ -32,23 +32,21 @@ if __name__ == "__main__":
 
     # Read t_item.tbl.original (or t_item.tbl if original not available)
     if os.path.exists('t_item.tbl.original'):
-        t_item = kt.read_table('t_item.tbl.original')
+        t_item = kt.read_table('t_item.tbl.original', sections = ['ItemTableData'], columns = ['id', 'name'])
     else:
-        t_item = kt.read_table('t_item.tbl')
+        t_item = kt.read_table('t_item.tbl', sections = ['ItemTableData'], columns = ['id', 'name'])
 
     # Find originals
-    items = {x['id']:x['name'] for x in t_item['ItemTableData']}
+    orig_index = kuro_reference_index(t_item)
     
     # Find conflicts with original item table
-    item_conflicts = [x for x in kt.new_entries['ItemTableData'] if x['id'] in items.keys()]
+    item_conflicts = [x for x in kt.new_entries['ItemTableData'] if x['id'] in orig_index.items]
     if len(item_conflicts) > 0:
         print("The following item conflicts were found:")
         for i in range(len(item_conflicts)):
-            matches = [kt.new_entries_sources['ItemTableData_primary_key'][j][item_conflicts[i]['id']]
-                for j in range(len(kt.new_entries_sources['ItemTableData_primary_key']))
-                if item_conflicts[i]['id'] in kt.new_entries_sources['ItemTableData_primary_key'][j]]
+            matches = kt.new_entries_sources['ItemTableData_primary_key'][item_conflicts[i]['id']]
             print("{}. {} - {} in {} conflicts with {} in t_item!".format(i+1, item_conflicts[i]['id'],
-                item_conflicts[i]['name'], matches, items[item_conflicts[i]['id']]))
+                item_conflicts[i]['name'], matches, orig_index.items[item_conflicts[i]['id']]['name']))
     else:
         print("No conflicts with t_item.tbl!")
     input("Press Enter to Continue.")
@@ -57,25 +55,23 @@ if __name__ == "__main__":
 
     # Read t_dlc.tbl.original (or t_dlc.tbl if original not available)
     if os.path.exists('t_dlc.tbl.original'):
-        t_dlc = kt.read_table('t_dlc.tbl.original')
+        t_dlc = kt.read_table('t_dlc.tbl.original', sections = ['DLCTableData', 'DLCTable'], columns = ['id', 'name'])
     else:
-        t_dlc = kt.read_table('t_dlc.tbl')
+        t_dlc = kt.read_table('t_dlc.tbl', sections = ['DLCTableData', 'DLCTable'], columns = ['id', 'name'])
 
     # Find originals
     dlc_header = 'DLCTableData' if 'DLCTableData' in t_dlc else 'DLCTable' if 'DLCTable' in t_dlc else ''
     if not dlc_header == '':
         pkey = {'DLCTableData':'DLCTableData_primary_key', 'DLCTable':'DLCTable_primary_key'}[dlc_header]
-        dlcs = {x['id']:x['name'] for x in t_dlc[dlc_header]}
+        orig_index.add_sections(t_dlc)
         # Find conflicts with original item table
-        dlc_conflicts = [x for x in kt.new_entries[dlc_header] if x['id'] in dlcs.keys()]
+        dlc_conflicts = [x for x in kt.new_entries[dlc_header] if x['id'] in orig_index.dlcs]
         if len(dlc_conflicts) > 0:
             print("The following dlc conflicts were found:")
             for i in range(len(dlc_conflicts)):
-                matches = [kt.new_entries_sources[pkey][j][dlc_conflicts[i]['id']]
-                    for j in range(len(kt.new_entries_sources[pkey]))
-                    if dlc_conflicts[i]['id'] in kt.new_entries_sources[pkey][j]]
+                matches = kt.new_entries_sources[pkey][dlc_conflicts[i]['id']]
                 print("{}. {} - {} in {} conflicts with {} in t_dlc!".format(i+1, dlc_conflicts[i]['id'],
-                    dlc_conflicts[i]['name'], matches, dlcs[dlc_conflicts[i]['id']]))
+                    dlc_conflicts[i]['name'], matches, orig_index.dlcs[dlc_conflicts[i]['id']]['name']))
         else:
             print("No conflicts with t_dlc.tbl!")
     else:
@@ -31,10 +31,13 @@ if __name__ == "__main__":
         parser.add_argument('-c', '--compression', help="Compression format",
             choices = ['none', 'lz4', 'zstd', 'zstd-dict'], default='lz4')
         parser.add_argument('-v', '--version', help="P3A version", choices = ['1100', '1200'], default='1100')
+        parser.add_argument('-j', '--jobs', help="Number of files to compress at the same time (default: one per CPU)",
+            type=int, default=None)
         args = parser.parse_args()
         if os.path.exists(args.folder_name):
             p3a.pack_folder(args.folder_name, args.output_name, overwrite = args.overwrite,
-            cmp_type = {'none':0, 'lz4':1, 'zstd':2, 'zstd-dict':3}[args.compression], p3a_ver = int(args.version))
+            cmp_type = {'none':0, 'lz4':1, 'zstd':2, 'zstd-dict':3}[args.compression], p3a_ver = int(args.version),
+            jobs = args.jobs)
     else:
         all_folders = [x for x in glob.glob('*', recursive = False) if os.path.isdir(x)]
         all_folders = [x for x in all_folders if x != '__pycache__']
@@ -28,9 +28,12 @@ if __name__ == "__main__":
         parser.add_argument('p3a_archive', help="Name of file to decompress (required).")
         parser.add_argument('-f', '--output_folder', help="Name of output folder (optional)", default=None)
         parser.add_argument('-o', '--overwrite', help="Overwrite existing files", action="store_true")
+        parser.add_argument('-j', '--jobs', help="Number of files to decompress at the same time (default: one per CPU)",
+            type=int, default=None)
         args = parser.parse_args()
         if os.path.exists(args.p3a_archive):
-            p3a.extract_all_files(args.p3a_archive, output_dir = args.output_folder, overwrite = args.overwrite)
+            p3a.extract_all_files(args.p3a_archive, output_dir = args.output_folder, overwrite = args.overwrite,
+                jobs = args.jobs)
     else:
         all_files = glob.glob('*.p3a', recursive = False)
         for i in range(len(all_files)):
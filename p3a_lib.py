@@ -3,7 +3,8 @@
 # GitHub eArmada8/kuro_dlc_tool
 
 try:
-    import struct, math, io, json, os, sys, glob
+    import struct, math, io, json, os, sys, glob, threading, collections, mmap, time
+    import concurrent.futures
     import lz4.block, zstandard, xxhash
 except ModuleNotFoundError as e:
     print("Python module missing! {}".format(e.msg))
@@ -42,7 +43,17 @@ class p3a_class:
             if header['version'] >= 1200:
                 header['p3a_hash_2'], header['ext_header_size'], header['entry_size']\
                     = struct.unpack("<Q2I", self.f.read(16))
-            entries = [self.read_entry(header['version']) for i in range(header['num_files'])]
+            # The whole TOC is read at once and unpacked record by record, instead of a read_entry() call per file
+            if header['version'] >= 1200:
+                toc_format = "<256s6Q{}x".format(max(0, header['entry_size'] - 304)) # Skip any fields added later
+                entries = [{'name': x[0].split(b'\x00', 1)[0].decode('utf-8'), 'cmp_type': x[1], 'cmp_size': x[2],
+                    'unc_size': x[3], 'offset': x[4], 'cmp_hash': x[5], 'unc_hash': x[6]}
+                    for x in struct.iter_unpack(toc_format, self.f.read(struct.calcsize(toc_format) * header['num_files']))]
+            else:
+                toc_format = "<256s5Q"
+                entries = [{'name': x[0].split(b'\x00', 1)[0].decode('utf-8'), 'cmp_type': x[1], 'cmp_size': x[2],
+                    'unc_size': x[3], 'offset': x[4], 'cmp_hash': x[5]}
+                    for x in struct.iter_unpack(toc_format, self.f.read(struct.calcsize(toc_format) * header['num_files']))]
             if header['flags'] & 1 == 1:
                 p3a_dict = zstandard.ZstdCompressionDict(self.read_dict())
             else:
@@ -52,12 +63,42 @@ class p3a_class:
             input("Not P3A! Press Enter to continue")
             return []
 
-    def read_file (self, entry, p3a_dict):
+    # Returns the compressed data of an entry as stored in the archive, or None if it is corrupt
+    def read_cmp_data (self, entry):
         self.f.seek(entry['offset'])
-        cmp_data = self.f.read(entry['cmp_size'])
+        return(self.check_cmp_data(entry, self.f.read(entry['cmp_size'])))
+
+    # Returns cmp_data, or None (after telling the user) if it does not match the hash in the entry
+    def check_cmp_data (self, entry, cmp_data):
+        error = self.verify_cmp_data(entry, cmp_data)
+        if error is not None:
+            input("{}  Press Enter to continue.".format(error))
+            return(None)
+        return(cmp_data)
+
+    # Same check as check_cmp_data(), but does not stop for input, so it can be used from worker threads.
+    # Returns the message to show if cmp_data is corrupt, otherwise None.
+    def verify_cmp_data (self, entry, cmp_data):
         if not xxhash.xxh64_intdigest(cmp_data) == entry['cmp_hash']:
-            input("{} is corrupt, skipping.  Press Enter to continue.".format(entry['name']))
+            return("{} is corrupt, skipping.".format(entry['name']))
+        return(None)
+
+    def read_file (self, entry, p3a_dict):
+        cmp_data = self.read_cmp_data(entry)
+        if cmp_data is None:
             return(b'')
+        return(self.decompress_data(entry, cmp_data, p3a_dict))
+
+    # Decompresses (and checks) the data of an entry read with read_cmp_data(), returns b'' on failure
+    def decompress_data (self, entry, cmp_data, p3a_dict):
+        unc_data, error = self.unpack_data(entry, cmp_data, p3a_dict)
+        if error is not None:
+            input("{}  Press Enter to continue.".format(error))
+        return(unc_data)
+
+    # Same as decompress_data(), but does not stop for input, so it can be used from worker threads.
+    # Returns (unc_data, error), on failure unc_data is b'' and error is the message to show.
+    def unpack_data (self, entry, cmp_data, p3a_dict):
         if entry['cmp_type'] == 0:
             unc_data = cmp_data
         elif entry['cmp_type'] == 1:
@@ -69,21 +110,38 @@ class p3a_class:
             decompressor = zstandard.ZstdDecompressor(dict_data = p3a_dict)
             unc_data = decompressor.decompress(cmp_data)
         else:
-            input("{0} is unknown compression (type {1}), skipping.  Press Enter to continue.".format(entry['name'],
-                entry['cmp_type']))
-            unc_data = b''
+            return(b'', "{0} is unknown compression (type {1}), skipping.".format(entry['name'], entry['cmp_type']))
         if len(unc_data) > 0 and 'unc_hash' in entry:
             if not xxhash.xxh64_intdigest(unc_data) == entry['unc_hash']:
-                input("{} is corrupt, skipping.  Press Enter to continue.".format(entry['name']))
-                return(b'')
-        return(unc_data)
+                return(b'', "{} is corrupt, skipping.".format(entry['name']))
+        return(unc_data, None)
 
     # assigned_paths are specific names for each file, and are optional.
     # The key should match the file in file_list, and the value is the new name.
     # For example, if '/path/to/file1' is in file_list, then assigned_path could have
     # a key:value of '/path/to/file1':'/different/path/to/file2', and '/path/to/file1'
     # will be stored in the p3a as '/different/path/to/file2'.
-    def p3a_pack_files (self, file_list, assigned_paths = {}, cmp_type = 1, p3a_ver = 1100):
+    # precompressed is also optional, the key should match the file in file_list and the value is a dict
+    # with the 'cmp_type', 'cmp_data', 'unc_size' and 'unc_hash' of data that is already compressed (e.g. read
+    # with read_cmp_data() from an older archive).  The file is then not read or compressed again.  Not for use
+    # with cmp_type 3, as the dictionary is trained again for every archive.
+    # payloads is also optional, the key should match the file in file_list and the value is the (uncompressed)
+    # contents of the file as bytes, which is then used instead of reading the file from disk.
+    # Files are read and compressed by up to jobs threads (default is one per CPU), the compressors release the
+    # GIL.  The results are used in file_list order, so the archive is the same for any number of jobs.
+    # Returns the whole archive as bytes, use p3a_write_files() to write large archives directly to a file.
+    def p3a_pack_files (self, file_list, assigned_paths = {}, cmp_type = 1, p3a_ver = 1100, precompressed = {},
+            payloads = {}, jobs = None):
+        with io.BytesIO() as f:
+            self.p3a_write_files(f, file_list, assigned_paths, cmp_type, p3a_ver, precompressed, payloads, jobs)
+            return(f.getvalue())
+
+    # Same as p3a_pack_files(), but the archive is streamed to f (a file opened for binary writing, which must
+    # support seek).  Space for the header is reserved first, each file is written as soon as it is compressed
+    # and the header is written last.  At most max_in_flight files (default is 2 per job) are held in memory at
+    # the same time, regardless of the size of the archive.
+    def p3a_write_files (self, f, file_list, assigned_paths = {}, cmp_type = 1, p3a_ver = 1100, precompressed = {},
+            payloads = {}, jobs = None, max_in_flight = None):
         def return_256_len_str(string):
             assert len(string) <= 256
             return(string.encode('utf-8') + b'\x00'*(256-len(string)))
@@ -91,44 +149,67 @@ class p3a_class:
         header_length = ({1100: 32, 1200: 48}[p3a_ver]
             + {1100: 296, 1200: 304}[p3a_ver] * len(file_list))
         file_data = []
-        if cmp_type == 2:
-            zstd_compressor = zstandard.ZstdCompressor(level = 12, write_checksum = True)
+        zstd_params = {'level': 12, 'write_checksum': True}
         if cmp_type == 3:
             p3a_flags = p3a_flags | 1
             dict_size = 112640
             print("Generating dictionary...")
-            samples = [open(file, 'rb').read() for file in file_list]
+            samples = [payloads[file] if file in payloads else open(file, 'rb').read() for file in file_list]
             zdict = zstandard.train_dictionary(dict_size, samples)
             header_length += len(zdict.as_bytes()) + 16
-            zstd_compressor = zstandard.ZstdCompressor(level = 12, dict_data = zdict, write_checksum = True)
+            zstd_params['dict_data'] = zdict
         header_length = math.ceil(header_length / 64) * 64
+        # ZstdCompressor objects cannot be shared between threads, each thread makes its own
+        thread_data = threading.local()
+        def compress_file(file):
+            if file in precompressed:
+                return(precompressed[file]['cmp_type'], precompressed[file]['cmp_data'],
+                    xxhash.xxh64_intdigest(precompressed[file]['cmp_data']),
+                    precompressed[file]['unc_size'], precompressed[file]['unc_hash'])
+            if file in payloads:
+                unc_data = payloads[file]
+            else:
+                with open(file, 'rb') as f2:
+                    unc_data = f2.read()
+            if cmp_type == 0:
+                cmp_data = unc_data
+            elif cmp_type == 1:
+                cmp_data = lz4.block.compress(unc_data, mode = 'high_compression', store_size=False)
+            elif cmp_type in [2,3]:
+                if not hasattr(thread_data, 'zstd_compressor'):
+                    thread_data.zstd_compressor = zstandard.ZstdCompressor(**zstd_params)
+                cmp_data = thread_data.zstd_compressor.compress(unc_data)
+            return(cmp_type, cmp_data, xxhash.xxh64_intdigest(cmp_data), len(unc_data), xxhash.xxh64_intdigest(unc_data))
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        jobs = max(1, jobs)
+        if max_in_flight is None:
+            max_in_flight = jobs * 2
+        max_in_flight = max(1, max_in_flight)
         print("Compressing files...")
-        with io.BytesIO() as f:
-            toc = []
+        archive_start = f.tell()
+        f.write(b'\x00' * header_length)
+        with concurrent.futures.ThreadPoolExecutor(max_workers = jobs) as executor:
+            compressed_files = collections.deque()
             for i in range(len(file_list)):
-                with open(file_list[i], 'rb') as f2:
-                    unc_data = f2.read()
-                if cmp_type == 0:
-                    cmp_data = unc_data
-                elif cmp_type == 1:
-                    cmp_data = lz4.block.compress(unc_data, mode = 'high_compression', store_size=False)
-                elif cmp_type in [2,3]:
-                    cmp_data = zstd_compressor.compress(unc_data)
+                # Keep up to max_in_flight files queued, in order
+                while len(compressed_files) < max_in_flight and i + len(compressed_files) < len(file_list):
+                    compressed_files.append(executor.submit(compress_file, file_list[i + len(compressed_files)]))
+                entry_cmp_type, cmp_data, cmp_hash, unc_size, unc_hash = compressed_files.popleft().result()
                 if file_list[i] in assigned_paths:
                     file_path = assigned_paths[file_list[i]]
                     file_path = "".join([x if x not in ":*?<>|" else "_" for x in file_path]) #Sanitize
                 else:
                     file_path = file_list[i]
-                file_entry = {'name': file_path, 'cmp_type': cmp_type, 'cmp_size': len(cmp_data),
-                    'unc_size': len(unc_data), 'offset': f.tell() + header_length,
-                    'cmp_hash': xxhash.xxh64_intdigest(cmp_data), 'unc_hash': xxhash.xxh64_intdigest(unc_data)}
+                file_entry = {'name': file_path, 'cmp_type': entry_cmp_type, 'cmp_size': len(cmp_data),
+                    'unc_size': unc_size, 'offset': f.tell() - archive_start,
+                    'cmp_hash': cmp_hash, 'unc_hash': unc_hash}
                 f.write(cmp_data)
+                del(cmp_data)
                 file_data.append(file_entry)
                 if i < len(file_list) - 1:
-                    while f.tell() % 64 > 0: #64-byte alignment
-                        f.write(b'\x00')
-            f.seek(0)
-            file_block = f.read()
+                    f.write(b'\x00' * (-(f.tell() - archive_start) % 64)) #64-byte alignment
+        archive_end = f.tell()
         header = b'PH3ARCV\x00' + struct.pack("<2IQ", p3a_flags, p3a_ver, len(file_list))
         header += struct.pack("<Q", xxhash.xxh64_intdigest(header))
         if p3a_ver >= 1200:
@@ -145,29 +226,78 @@ class p3a_class:
             header += b'P3ADICT\x00' + struct.pack("<Q", len(zdict.as_bytes())) + zdict.as_bytes()
         if len(header) % 64 > 0: #64-byte alignment
             header += b''.join([b'\x00']*(64-(len(header) % 64)))
-        return(header + file_block)
+        assert len(header) == header_length
+        f.seek(archive_start)
+        f.write(header)
+        f.seek(archive_end)
+        return
 
-    def extract_all_files (self, p3a_archive, output_dir = None, overwrite = False):
+    # Extraction is pipelined: the calling thread reads the compressed files from the archive (in archive order), up to jobs
+    # threads (default is one per CPU) check and decompress them, and a few threads write them out.  At most
+    # max_in_flight files (default is 2 per job) are held in memory at the same time.  Overwrite questions are asked
+    # before anything is extracted, and corrupt files are reported in TOC order once extraction is done.
+    def extract_all_files (self, p3a_archive, output_dir = None, overwrite = False, jobs = None, max_in_flight = None):
         with open(p3a_archive,'rb') as self.f:
             headers, entries, p3a_dict = self.read_p3a_toc()
             if output_dir == None:
                 output_dir = p3a_archive[:-4]
+            entries_to_extract = []
             for i in range(len(entries)):
-                file_data = self.read_file(entries[i], p3a_dict)
-                if len(file_data) > 0:
-                    overwrite_files = overwrite
-                    if os.path.exists(output_dir + '/' + entries[i]['name']) and (overwrite == False):
-                        if str(input(output_dir + '/' + entries[i]['name'] + " exists! Overwrite? (y/N) ")).lower()[0:1] == 'y':
-                            overwrite_files = True
-                    if not os.path.exists(output_dir + '/' + entries[i]['name']) or overwrite_files == True:
-                        if not os.path.exists(output_dir + '/' + os.path.dirname(entries[i]['name'])):
-                            os.makedirs(output_dir + '/' + os.path.dirname(entries[i]['name']))
-                        with open(output_dir + '/' + entries[i]['name'], 'wb') as f2:
+                if os.path.exists(output_dir + '/' + entries[i]['name']) and (overwrite == False):
+                    if not str(input(output_dir + '/' + entries[i]['name'] + " exists! Overwrite? (y/N) ")).lower()[0:1] == 'y':
+                        continue
+                entries_to_extract.append(entries[i])
+            for folder in sorted(set([os.path.dirname(x['name']) for x in entries_to_extract])):
+                os.makedirs(output_dir + '/' + folder, exist_ok = True)
+            if jobs is None:
+                jobs = os.cpu_count() or 1
+            jobs = max(1, jobs)
+            if max_in_flight is None:
+                max_in_flight = jobs * 2
+            in_flight = threading.BoundedSemaphore(max(1, max_in_flight))
+            errors, extracted, lock = [], [0, 0], threading.Lock() # errors are (TOC index, message), extracted is [files, bytes]
+            def unpack_file(entry, cmp_data):
+                error = self.verify_cmp_data(entry, cmp_data)
+                if error is not None:
+                    return(b'', error)
+                return(self.unpack_data(entry, cmp_data, p3a_dict))
+            def write_file(i, entry, unpacked):
+                try:
+                    file_data, error = unpacked.result()
+                    if error is not None:
+                        with lock:
+                            errors.append((i, error))
+                    elif len(file_data) > 0:
+                        with open(output_dir + '/' + entry['name'], 'wb') as f2:
                             f2.write(file_data)
+                        with lock:
+                            extracted[0] += 1
+                            extracted[1] += len(file_data)
+                finally:
+                    in_flight.release()
+            start_time = time.perf_counter()
+            with concurrent.futures.ThreadPoolExecutor(max_workers = jobs) as unpack_executor,\
+                    concurrent.futures.ThreadPoolExecutor(max_workers = min(jobs, 4)) as write_executor:
+                written_files = []
+                for i in sorted(range(len(entries_to_extract)), key = lambda x: entries_to_extract[x]['offset']):
+                    in_flight.acquire()
+                    self.f.seek(entries_to_extract[i]['offset'])
+                    cmp_data = self.f.read(entries_to_extract[i]['cmp_size'])
+                    written_files.append(write_executor.submit(write_file, i, entries_to_extract[i],
+                        unpack_executor.submit(unpack_file, entries_to_extract[i], cmp_data)))
+                for written_file in written_files:
+                    written_file.result() # Raises any error from writing
+            elapsed_time = max(time.perf_counter() - start_time, 1e-6)
+            for i, error in sorted(errors):
+                input("{}  Press Enter to continue.".format(error))
+            print("Extracted {0} files ({1:.1f} MB) in {2:.1f} seconds, {3:.1f} MB/s.".format(
+                extracted[0], extracted[1] / 1048576, elapsed_time, extracted[1] / 1048576 / elapsed_time))
         return
 
     # if output_name is None, then the name of the folder will be used.
-    def pack_folder (self, folder_name, output_name = None, overwrite = False, cmp_type = 1, p3a_ver = 1100):
+    # The archive is streamed to disk (see p3a_write_files()), so memory use does not grow with the size of the folder.
+    def pack_folder (self, folder_name, output_name = None, overwrite = False, cmp_type = 1, p3a_ver = 1100, jobs = None,
+            max_in_flight = None):
         if output_name == None:
             p3a_name = folder_name + '.p3a'
         else:
@@ -181,11 +311,85 @@ class p3a_class:
             file_list = [x.replace('\\','/') for x in glob.glob('**/*',root_dir=folder_name,recursive=True)
                 if not os.path.isdir(folder_name+'/'+x)]
             assigned_paths = {folder_name+'/'+x:x for x in file_list}
-            p3a_data = self.p3a_pack_files (list(assigned_paths.keys()), assigned_paths,
-                cmp_type = cmp_type, p3a_ver = p3a_ver)
-            with open(p3a_name, 'wb') as f:
-                f.write(p3a_data)
+            # Written under a temporary name, so an interrupted run does not leave a broken archive behind
+            try:
+                with open(p3a_name + '.tmp', 'wb') as f:
+                    self.p3a_write_files (f, list(assigned_paths.keys()), assigned_paths,
+                        cmp_type = cmp_type, p3a_ver = p3a_ver, jobs = jobs, max_in_flight = max_in_flight)
+            except BaseException:
+                if os.path.exists(p3a_name + '.tmp'):
+                    os.remove(p3a_name + '.tmp')
+                raise
+            os.replace(p3a_name + '.tmp', p3a_name)
         return
 
+# Random access to the files in a P3A archive.  The archive is memory-mapped and the entries are indexed by
+# name and by basename, so files are found without searching the TOC.  Reads are slices of the map instead of
+# seek() / read() on a shared file object, so one reader can be used from several threads at the same time.
+# Use as a context manager (with p3a_reader('script_en.p3a') as p3a:), or call close() when done.
+class p3a_reader:
+    def __init__ (self, p3a_archive):
+        self.filename = p3a_archive
+        self.p3a = p3a_class()
+        self.p3a.f = open(p3a_archive, 'rb')
+        toc = self.p3a.read_p3a_toc()
+        if len(toc) == 3:
+            self.header, self.entries, self.p3a_dict = toc
+            self.mm = mmap.mmap(self.p3a.f.fileno(), 0, access = mmap.ACCESS_READ)
+        else:
+            self.header, self.entries, self.p3a_dict = {}, [], None
+            self.mm = None
+        self.names = {x['name']:x for x in self.entries}
+        self.basenames = {}
+        for entry in self.entries:
+            self.basenames.setdefault(os.path.basename(entry['name']), []).append(entry)
+
+    def __enter__ (self):
+        return(self)
+
+    def __exit__ (self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close (self):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.p3a.f.close()
+
+    def __contains__ (self, name):
+        return(self.get_entry(name) is not None)
+
+    # Returns the entry with this full name (P3A names are lower case, name is matched either way) or None
+    def get_entry (self, name):
+        if name in self.names:
+            return(self.names[name])
+        return(self.names.get(name.lower(), None))
+
+    # Returns a list of all the entries with this basename (e.g. 't_item.tbl'), in archive order
+    def find (self, basename):
+        basename = os.path.basename(basename)
+        return(list(self.basenames.get(basename, self.basenames.get(basename.lower(), []))))
+
+    # Returns the compressed data of an entry as stored in the archive, or None if it is corrupt
+    def read_cmp_data (self, entry):
+        if isinstance(entry, str):
+            entry = self.get_entry(entry)
+        return(self.p3a.check_cmp_data(entry, self.mm[entry['offset']:entry['offset'] + entry['cmp_size']]))
+
+    # Returns the contents of a file (by name or entry) as bytes, b'' if it could not be read
+    def read (self, entry):
+        if isinstance(entry, str):
+            entry = self.get_entry(entry)
+            if entry is None:
+                return(b'')
+        cmp_data = self.read_cmp_data(entry)
+        if cmp_data is None:
+            return(b'')
+        return(self.p3a.decompress_data(entry, cmp_data, self.p3a_dict))
+
+    # Returns the contents of a file (by name or entry) as a read-only file object
+    def open (self, entry):
+        return(io.BytesIO(self.read(entry)))
+
 if __name__ == "__main__":
     pass
\ No newline at end of file